@@ -0,0 +1,32 @@
+"""
+File: bench_ff2.py
+
+Timing benchmark for ff1 and ff2 (the relaxed planning graph in heuristics.RelaxedGraph)
+against ff1_product and ff2_product (the older versions that build their layers from
+Cartesian products). For each of random_probs.problem0..99, it times each pair of them on
+the problem's starting state, and it prints the averages for each group of 20 problems of
+the same size.
+"""
+from timeit import timeit
+import heuristics, racetrack, random_probs
+
+for funcs in [["heuristics.ff1", "heuristics.ff1_product"], ["heuristics.ff2", "heuristics.ff2_product"]]:
+    times = {f: 0 for f in funcs}
+    differ = 0
+    for j in range(100):
+        p = getattr(random_probs, "problem{}".format(j))
+        walls = racetrack.WallIndex(p[2])
+        results = []
+        for f in funcs:
+            s = "results.append({}(({}, (0, 0)), p[1], walls))".format(f, p[0])
+            times[f] += timeit(stmt=s, number=1, globals=globals())
+        # the layers are the same, but the extracted relaxed solutions may differ
+        h = [sum(len(e) for e in r) if r else r for r in results]
+        differ += h[0] != h[1]
+        if (j + 1) % 20 == 0:
+            print("Problem size {}:".format(4 * (j + 21) // 20), end='')
+            for f in funcs:
+                print("  {} {:.4f} seconds on average".format(f, times[f] / 20), end='')
+            print("  ({:.1f}x faster)".format(times[funcs[1]] / times[funcs[0]]))
+            times = {f: 0 for f in funcs}
+    print("h_{} values differed on {} of the 100 starting states".format(funcs[0].split('.')[1], differ))
@@ -0,0 +1,29 @@
+"""
+File: bench_landmarks.py
+
+Compares landmarks.h_alt with h_walldist and h_esdist, using A* on the problems in
+random_probs (which were made by maketracks.make_one) and some of the sample problems.
+For each problem and heuristic, it prints the number of nodes generated, the solution
+length and the running time. h_alt is the only one of them that's admissible, so its
+solution lengths are the optimal ones.
+"""
+import io, re, time, contextlib
+import heuristics, landmarks, racetrack, sample_probs, random_probs
+
+names = ['rect20a', 'lhook16', 'rhook16a', 'spiral16', 'rectwall16']
+problems = [(name, getattr(sample_probs, name)) for name in names]
+problems += [('problem{}'.format(j), getattr(random_probs, 'problem{}'.format(j))) for j in range(4, 100, 8)]
+
+for (name, p) in problems:
+    print(name + ':')
+    for h in [heuristics.h_walldist, heuristics.h_esdist, landmarks.h_alt]:
+        out = io.StringIO()
+        t = time.time()
+        with contextlib.redirect_stdout(out):
+            path = racetrack.main(p, 'a*', h, verbose=1, draw=0)
+        t = time.time() - t
+        generated = re.search(r'Generated (\d+)', out.getvalue()).group(1)
+        print('    {:10} generated {:>6}, path length {:>2}, {:.2f} seconds'.format(
+            h.__name__, generated, len(path) - 1, t))
+    heuristics.tear_down()
+    landmarks.clear_landmark_tables()
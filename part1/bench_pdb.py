@@ -0,0 +1,24 @@
+"""
+File: bench_pdb.py
+
+Compares h_pdb with h_walldist. For each problem, it builds the pattern database (printing
+its build time and size), which h_pdb then uses, and then runs gbf with each of the two heuristics and prints
+the number of nodes generated and the solution length.
+"""
+import io, re, sys, contextlib
+import heuristics, racetrack, sample_probs, random_probs
+
+names = ['rect20a', 'rect20d', 'lhook16', 'rhook16a', 'spiral16', 'rectwall16', 'wall8a']
+problems = [(name, getattr(sample_probs, name)) for name in names]
+problems += [('problem{}'.format(j), getattr(random_probs, 'problem{}'.format(j))) for j in range(0, 100, 10)]
+
+for (name, p) in problems:
+    print(name, end=': ')
+    heuristics.track_pdb(p[1], p[2])
+    for h in [heuristics.h_walldist, heuristics.h_pdb]:
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            path = racetrack.main(p, 'gbf', h, verbose=1, draw=0)
+        generated = re.search(r'Generated (\d+)', out.getvalue()).group(1)
+        print('    {:10} generated {:>6}, path length {}'.format(h.__name__, generated, len(path) - 1))
+    heuristics.tear_down()
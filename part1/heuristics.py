@@ -1,13 +1,17 @@
 """
 File: heuristics.py -- Fan Yang & Dana Nau, Feb 14, 2018
 
-This file contains five heuristic functions:
+This file contains ten heuristic functions:
 - h_edist returns the Euclidean distance from (s) to the goal, ignoring walls;
 - h_esdist modifies h_edist to include an estimate of how long it will take to stop;
 - h_walldist computes the approximate distance to the goal without ignoring walls. 
+- h_pdb looks up the exact number of moves to the goal in a table computed for the track
+    (a pattern database) that holds every state whose speed allows it to stop on the track.
 - h_ff1 and h_ff2 return the fast-forward distances as described in the project description.
     (h_ff1 and ff1 corresponds to state-variable representation 1; h_ff2 and ff2 correspond
     to state-variable representation 2.)
+- h_add1, h_add2, h_max1 and h_max2 return the additive and max costs of reaching the goal
+    in the same relaxed problems (see RelaxedGraph.cost).
  Each heuristic function takes three arguments: state, edge, walls.
    state is the current state. It should have the form ((x,y), (u,v))
    edge is the finish line. It should have the form ((x1,y1), (x2,y2))
@@ -16,13 +20,412 @@ This file contains five heuristic functions:
 
 import sys
 import math
+import time
+import heapq
+import hashlib
+import os
+import numpy
 import racetrack
+import landmarks
 from itertools import product
+from collections import OrderedDict
 
 
-# cached_states momerizes the visited states so that we can avoid calculating
-# the same state multiple times.
-cached_states = {}
+# h_ff1, h_ff2, h_add1, h_add2, h_max1 and h_max2 memorize the values they compute, so
+# that we can avoid calculating the same state multiple times. Each track has its own
+# memo for each of them (see TrackContext), holding at most ff_memo_size states; when it's
+# full, the least recently used state is forgotten, and so are the older half of them if
+# the contexts don't fit in context_budget (see trim_contexts). ff_memo_stats counts, for
+# all tracks together, the lookups that found a value (hits), the ones that didn't
+# (misses), and the states forgotten because a memo was full (evictions).
+ff_memo_size = 20000
+ff_memo_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def ff_memo_value(name, state, fline, walls, rep, kind):
+    """
+    Return relaxed_value(state, fline, walls, rep, kind), using the memo named name in
+    the track's context.
+    """
+    ctx = track_context(fline, walls)
+    memo = ctx.values.get(name)
+    if memo is None:
+        memo = ctx.values[name] = OrderedDict()
+    if state in memo:
+        ff_memo_stats['hits'] += 1
+        memo.move_to_end(state)
+        return memo[state]
+    ff_memo_stats['misses'] += 1
+    value = relaxed_value(state, fline, walls, rep, kind)
+    memo[state] = value
+    if len(memo) > ff_memo_size:
+        memo.popitem(last=False)
+        ff_memo_stats['evictions'] += 1
+    trim_contexts()
+    return value
+
+
+def ff_memo_hit_rate():
+    # fraction of ff memo lookups that found a value
+    lookups = ff_memo_stats['hits'] + ff_memo_stats['misses']
+    return ff_memo_stats['hits'] / lookups if lookups else 0.0
+
+
+
+def split1(s):
+    # the values of the state variables of representation 1 (x, y, u, v) for s = (x, y, u, v)
+    return s
+
+
+def split2(s):
+    # the values of the state variables of representation 2 (location, velocity) for s = (x, y, u, v)
+    return ((s[0], s[1]), (s[2], s[3]))
+
+
+class RelaxedGraph:
+    """
+    A relaxed planning graph for getting from state to the finish line, using state-variable
+    representation rep (1 or 2). Its facts are (i, value) pairs meaning that state variable
+    i may have that value. layer[i] maps each value of variable i to the first layer in which
+    it's reached, so a layer is linear in the number of facts instead of being a product of
+    them. An action is a (move, pre, eff) triple where pre and eff are (x, y, u, v) tuples,
+    and achievers maps each fact other than the initial ones to the actions that reach it
+    first, i.e., the actions in the layer just below the fact's layer. depth is the number
+    of layers needed to reach the goal, or None if it can't be reached.
+
+    The moves that can be made from each (x, y, u, v) tuple without crashing are looked up
+    in the track's racetrack.MoveTable (see MoveTable.successors). They don't depend on the
+    starting state, so the graphs of sibling states, or of any states on the same track,
+    share them instead of generating and crash-testing the same actions again.
+    """
+
+    def __init__(self, state, fline, walls, rep):
+        (x0, y0), (u0, v0) = state
+        (x1, y1), (x2, y2) = fline
+        x_fline = range(min(x1, x2), max(x1, x2) + 1)
+        y_fline = range(min(y1, y2), max(y1, y2) + 1)
+        self.rep = rep
+        self.split = (split1, split2)[rep - 1]
+        self.start = self.split((x0, y0, u0, v0))
+        if rep == 1:
+            self.goal = [set(x_fline), set(y_fline), {0}, {0}]
+        else:
+            self.goal = [set(product(x_fline, y_fline)), {(0, 0)}]
+        self.layer = [{value: 0} for value in self.start]
+        self.achievers = {}
+        self.table = racetrack.move_table(walls)
+        self.depth = None
+        self.expanded = False
+        self.results = {}
+        self.size = None
+
+    def expand(self):
+        """
+        Add layers until the goal is reached, and set depth to the number of layers, or to
+        None if a layer adds no new facts. Return depth. old[i] holds the values of variable i reached before
+        the current layer, and new[i] the ones reached in the current layer. An action
+        becomes applicable in the layer where the last of its preconditions appears, so the
+        actions that are new in a layer are the ones that have a precondition in new. Each
+        of them is generated exactly once, in sorted order so that ties are broken the same
+        way every time.
+        """
+        if self.expanded:
+            return self.depth
+        self.expanded = True
+        rep, split, layer, achievers = self.rep, self.split, self.layer, self.achievers
+        n = len(layer)
+        old, new = [set() for _ in layer], [set(d) for d in layer]
+        k = 0
+        while not all(self.goal[i] & layer[i].keys() for i in range(n)):
+            pres = []
+            for i in range(n):
+                pools = [sorted(old[j]) for j in range(i)] + [sorted(new[i])] + \
+                        [sorted(old[j] | new[j]) for j in range(i + 1, n)]
+                pres.extend(self.pres(pools))
+            candidates = []
+            for (pre, moves) in zip(pres, self.table.successors(pres)):
+                for (move, eff) in moves:
+                    # an action is only useful if it reaches a fact that isn't there yet
+                    _x, _y, _u, _v = eff
+                    if rep == 1:
+                        useful = _x not in layer[0] or _y not in layer[1] or \
+                                 _u not in layer[2] or _v not in layer[3]
+                    else:
+                        useful = (_x, _y) not in layer[0] or (_u, _v) not in layer[1]
+                    if useful:
+                        candidates.append((move, pre, eff))
+            added = [set() for _ in layer]
+            for a in candidates:
+                for (i, value) in enumerate(split(a[2])):
+                    if layer[i].get(value, k + 1) == k + 1:
+                        layer[i][value] = k + 1
+                        added[i].add(value)
+                        achievers.setdefault((i, value), []).append(a)
+            if not any(added): return None
+            old = [old[i] | new[i] for i in range(n)]
+            new = added
+            k += 1
+        self.depth = k
+        return k
+
+    def pres(self, pools):
+        # the (x, y, u, v) tuples whose variables have values in pools, in sorted order
+        if self.rep == 1:
+            return list(product(*pools))
+        return [p + z for (p, z) in product(*pools)]
+
+    def cost(self, combine=sum):
+        """
+        Return the cost of reaching the goal, using combine to get the cost of a set of
+        facts from the costs of its members: sum gives h_add, and max gives h_max. Each
+        move costs 1. This is a generalized Dijkstra search over the facts: they are taken
+        from the queue in order of increasing cost, and an action's effects are put in the
+        queue with cost 1 + combine(the costs of its preconditions). With combine = max,
+        the cost of each fact is its layer, so the cost of the goal is the same as depth,
+        and that's how h_max gets it. Return infinity if the goal can't be reached.
+
+        The actions are generated when the last of their preconditions is taken, but not
+        all at once: levels[j] maps each cost to the values of variable j that were taken
+        with that cost, in the order they were taken. When (i, value) is taken, a group is
+        put in the queue for each combination of costs of the other variables, holding
+        the values taken so far with those costs. All of a group's actions cost the same,
+        so they are generated only if the search gets to that cost, together with the other
+        groups of that cost so that they can be crash-tested at once, and the groups that
+        cost more than the goal are never generated.
+        """
+        split, goal = self.split, self.goal
+        n = len(self.start)
+        cost = [{} for _ in range(n)]
+        levels = [{} for _ in range(n)]
+        best = [{} for _ in range(n)]
+        goal_cost = [None] * n
+        # a fact is (cost, 0, i, value), and a group is (cost, 1, count, i, value, pools)
+        queue = [(0, 0, i, value) for (i, value) in enumerate(self.start)]
+        count = 0
+        while queue:
+            entry = heapq.heappop(queue)
+            if entry[1] == 1:
+                # generate all of the groups with this cost, crash-testing them together
+                c1 = entry[0]
+                pres = self.pres(entry[5])
+                while queue and queue[0][0] == c1 and queue[0][1] == 1:
+                    pres.extend(self.pres(heapq.heappop(queue)[5]))
+                for moves in self.table.successors(pres):
+                    for (move, eff) in moves:
+                        for (j, v) in enumerate(split(eff)):
+                            if v not in cost[j] and c1 < best[j].get(v, math.inf):
+                                best[j][v] = c1
+                                heapq.heappush(queue, (c1, 0, j, v))
+                continue
+            (c, _, i, value) = entry
+            if value in cost[i]: continue
+            cost[i][value] = c
+            levels[i].setdefault(c, []).append(value)
+            if goal_cost[i] is None and value in goal[i]:
+                goal_cost[i] = c
+                if None not in goal_cost:
+                    return combine(goal_cost)
+            # the groups of actions whose last precondition is (i, value)
+            choices = [sorted(levels[j]) if j != i else [c] for j in range(n)]
+            for costs in product(*choices):
+                pools = [levels[j][cj][:] if j != i else [value] for (j, cj) in enumerate(costs)]
+                count += 1
+                heapq.heappush(queue, (1 + combine(costs), 1, count, i, value, pools))
+        return math.inf
+
+    def value(self, kind):
+        """
+        Return the graph's 'ff', 'add' or 'max' value: the number of moves in the relaxed
+        solution, the additive cost, or the max cost. Return infinity if the goal can't be
+        reached. The values are kept in results, so asking again for a value, or for the
+        max value after the ff value, costs nothing.
+        """
+        if kind not in self.results:
+            if kind == 'add':
+                self.results[kind] = self.cost(sum)
+            elif self.expand() is None:
+                self.results[kind] = math.inf
+            elif kind == 'max':
+                self.results[kind] = self.depth
+            else:
+                self.results[kind] = sum([len(e) for e in self.extract()])
+        return self.results[kind]
+
+    def nbytes(self):
+        # rough estimate of the graph's size: an achiever is a list slot and a tuple, and a
+        # fact in a layer is a dict entry. It's computed once the graph has been expanded.
+        if not self.expanded:
+            return 1000
+        if self.size is None:
+            self.size = 90 * sum(map(len, self.achievers.values())) + 100 * sum(map(len, self.layer))
+        return self.size
+
+    def facts(self, s):
+        # the facts of the (x, y, u, v) tuple s
+        return list(enumerate(self.split(s)))
+
+    def chains(self):
+        """
+        Return a dict that maps each (x, y, u, v) tuple that a chain of achievers reaches
+        from the starting state to the achiever that ends the shortest such chain (None for
+        the starting state). An achiever's preconditions appear in earlier layers than its
+        effect, so going through the achievers layer by layer finds the shortest chains.
+        """
+        layer = self.layer
+        start = sum(self.start, ())
+        dist, via = {start: 0}, {start: None}
+        actions = [[] for _ in range(self.depth + 1)]
+        for ((i, value), acts) in self.achievers.items():
+            actions[layer[i][value]].extend(acts)
+        for acts in actions:
+            for a in acts:
+                d = dist.get(a[1])
+                if d is not None and d + 1 < dist.get(a[2], math.inf):
+                    dist[a[2]] = d + 1
+                    via[a[2]] = a
+        return via
+
+    def extract(self):
+        """
+        Extract a relaxed solution, going backwards from the last layer, and return it as a
+        list of the moves chosen in each layer. On the finish line we select a point that
+        has been reached; to ensure consistency, always the one closest to the starting
+        point. goals[j] holds the facts that must be reached in layer j. For each of them
+        that isn't reached yet by an action we've chosen, choose an achiever, preferring
+        ones that reach more of the other goals of the layer, then ones that add fewer new
+        goals, and then ones whose preconditions appear earlier. The achiever's
+        preconditions become goals of the layers where they first appear.
+
+        For representation 2, splitting an achiever's preconditions into a location goal
+        and a velocity goal would make each of them need its own achiever, so if a chain of
+        achievers reaches the preconditions (see chains), they become a single goal instead:
+        states[j] holds these (x, y, u, v) tuples, and each of them is reached by the last
+        achiever of its chain, whose preconditions are the next such goal.
+        """
+        layer, k, facts = self.layer, self.depth, self.facts
+        goals = [set() for _ in range(k + 1)]
+        for i in range(len(layer)):
+            c0 = self.start[i]
+            if self.rep == 1:
+                value = min(sorted(self.goal[i] & layer[i].keys()), key=lambda c: abs(c - c0))
+            else:
+                value = min(sorted(self.goal[i] & layer[i].keys()),
+                            key=lambda c: (c[0] - c0[0]) ** 2 + (c[1] - c0[1]) ** 2)
+            goals[layer[i][value]].add((i, value))
+        states = [set() for _ in range(k + 1)]
+        via = self.chains() if self.rep == 2 else {}
+
+        def first(s):
+            # the layer where all of the facts of s have appeared
+            return max(layer[i][c] for (i, c) in facts(s))
+
+        def new_goals(pre):
+            if pre in via:
+                return 0 if via[pre] is None or pre in states[first(pre)] else 1
+            return sum(layer[i][c] > 0 and (i, c) not in goals[layer[i][c]] for (i, c) in facts(pre))
+
+        def add_goals(pre):
+            if pre in via:
+                if via[pre] is not None:
+                    states[first(pre)].add(pre)
+                return
+            for (i, c) in facts(pre):
+                if layer[i][c] > 0:
+                    goals[layer[i][c]].add((i, c))
+
+        solution = [[] for _ in range(k)]
+        for j in range(k, 0, -1):
+            reached = set()
+            for s in sorted(states[j]):
+                move, pre, eff = via[s]
+                solution[j - 1].append(move)
+                reached.update(facts(eff))
+                add_goals(pre)
+            for g in sorted(goals[j]):
+                if g in reached: continue
+                remaining = goals[j] - reached
+                move, pre, eff = max(self.achievers[g], key=lambda a: (
+                    sum(f in remaining for f in facts(a[2])), -new_goals(a[1]),
+                    -sum(layer[i][c] for (i, c) in facts(a[1]))))
+                solution[j - 1].append(move)
+                reached.update(facts(eff))
+                add_goals(pre)
+        return solution
+
+
+# The RelaxedGraphs of the relaxed_graphs_size states used most recently on a track are
+# kept, so that h_ff, h_add and h_max can all use the same graph for a state. A graph can
+# take a few megabytes, so there aren't many of them.
+relaxed_graphs_size = 16
+
+
+def relaxed_value(state, fline, walls, rep, kind):
+    """
+    Return the 'ff', 'add' or 'max' value (see RelaxedGraph.value) of state, for
+    state-variable representation rep.
+    """
+    return relaxed_graph(state, fline, walls, rep).value(kind)
+
+
+def relaxed_graph(state, fline, walls, rep):
+    # the RelaxedGraph of state for representation rep, from the track's TrackContext
+    graphs = track_context(fline, walls).values.setdefault('graphs', OrderedDict())
+    key = (state, rep)
+    if key in graphs:
+        graphs.move_to_end(key)
+        return graphs[key]
+    graph = graphs[key] = RelaxedGraph(state, fline, walls, rep)
+    if len(graphs) > relaxed_graphs_size:
+        graphs.popitem(last=False)
+    trim_contexts()
+    return graph
+
+
+def relaxed_values(state, fline, walls, rep):
+    """
+    Return a dict of the 'ff', 'add' and 'max' values of state, all computed with a single
+    RelaxedGraph for state-variable representation rep.
+    """
+    graph = relaxed_graph(state, fline, walls, rep)
+    return {kind: graph.value(kind) for kind in ['ff', 'add', 'max']}
+
+
+def h_add1(state, fline, walls):
+    # additive cost of the goal in the relaxed problem for representation 1
+    return ff_memo_value('add1', state, fline, walls, 1, 'add')
+
+
+def h_add2(state, fline, walls):
+    # additive cost of the goal in the relaxed problem for representation 2
+    return ff_memo_value('add2', state, fline, walls, 2, 'add')
+
+
+def h_max1(state, fline, walls):
+    # max cost of the goal in the relaxed problem for representation 1 (it's admissible)
+    return ff_memo_value('max1', state, fline, walls, 1, 'max')
+
+
+def h_max2(state, fline, walls):
+    # max cost of the goal in the relaxed problem for representation 2 (it's admissible)
+    return ff_memo_value('max2', state, fline, walls, 2, 'max')
+
+
+def check_relaxed_max(problems, velocities=((0, 0), (1, 1), (2, -1))):
+    """
+    Check that RelaxedGraph.cost(max) gives the same values as the number of layers of
+    the relaxed planning graph, for both representations, on the starting locations of
+    problems with each of the given velocities. Return the number of disagreements.
+    """
+    disagree = 0
+    for (p0, fline, walls) in problems:
+        walls = racetrack.WallIndex(walls)
+        for z in velocities:
+            for rep in [1, 2]:
+                graph = RelaxedGraph((p0, z), fline, walls, rep)
+                if graph.cost(max) != graph.value('max'):
+                    disagree += 1
+    print('check_relaxed_max: {} states, {} disagreements'.format(2 * len(problems) * len(velocities), disagree))
+    return disagree
 
 
 def h_ff1(state, fline, walls):
@@ -32,16 +435,7 @@ def h_ff1(state, fline, walls):
     :param walls: the walls that cannot be crossed
     :return: an approximate number of steps needed to reach the finish line
     """
-    global cached_states
-    if state not in cached_states:
-        # If the state has not been cached yet, we calculate the number of needed
-        # steps and cache it.
-        solution = ff1(state, fline, walls)
-        if solution == False:
-            cached_states[state] = math.inf
-        else:
-            cached_states[state] = sum([len(e) for e in solution])
-    return cached_states[state]
+    return ff_memo_value('ff1', state, fline, walls, 1, 'ff')
 
 
 def ff1(state, fline, walls):
@@ -51,6 +445,23 @@ def ff1(state, fline, walls):
     :param walls: the walls that cannot be crossed
     :return: a list of moves that when applied to the starting state r-satisfy the goal
     """
+    # This uses a relaxed planning graph for state-variable representation 1, whose facts
+    # are the values of x, y, u and v.
+    graph = RelaxedGraph(state, fline, walls, 1)
+    if graph.expand() is None: return False
+    return graph.extract()
+
+
+def ff1_product(state, fline, walls):
+    """
+    The older version of ff1, which builds each layer from the Cartesian product of the
+    values reached so far. Its layers are the same as ff1's, but it is much slower, and it
+    extracts the relaxed solution differently, so the number of moves may differ.
+    :param state: the starting state
+    :param fline: the finish line
+    :param walls: the walls that cannot be crossed
+    :return: a list of moves that when applied to the starting state r-satisfy the goal
+    """
 
     # We first change the state to state variable representation 1. Note that I don't use
     # exactly the same representation as given in the project writeup. In the code below
@@ -71,17 +482,25 @@ def ff1(state, fline, walls):
     # until a subset of the curent state r-satisfies the goal.
     # curr, prev store the combinations of the the values of the four state variables
     curr, prev = {(x0, y0, u0, v0)}, set()
+    warr = racetrack.wall_array(walls)
     while not all(achieved):
         explored.append(state)
         actions = []
         # use curr - prev to avoid expanding the same value combination multiple times
+        candidates = []
         for x, y, u, v in curr - prev:
             pre = x, y, u, v
             for du, dv in ((du, dv) for du in [-1, 0, 1] for dv in [-1, 0, 1]):
-                eff = _x, _y, _u, _v = x + u + du, y + v + dv, u + du, v + dv
-                if eff in curr or racetrack.crash(((x, y), (_x, _y)), walls): continue
-                state = [state[i] | {eff[i]} for i in range(4)]
-                actions.append(((du, dv), pre, eff))
+                eff = x + u + du, y + v + dv, u + du, v + dv
+                if eff not in curr:
+                    candidates.append(((du, dv), pre, eff))
+        # test all of the layer's candidate moves against the walls at once
+        crashes = racetrack.crash_mask([((a[1][0], a[1][1]), (a[2][0], a[2][1])) for a in candidates], warr)
+        for (a, crashed) in zip(candidates, crashes):
+            if crashed: continue
+            eff = a[2]
+            state = [state[i] | {eff[i]} for i in range(4)]
+            actions.append(a)
         # If the current state and the next state are the same, then there exists no solution,
         # so we return false
         if not actions: return False
@@ -115,12 +534,12 @@ def ff1(state, fline, walls):
             # we can throw away all actions that either do not make progress towards the goal or make
             # no more progress than another action. The variable redundant denotes whether the action
             # can be thrown.
-            redundant = gain1 <= gain
+            redundant = all(g1 <= g for (g1, g) in zip(gain1, gain))
             for j in range(i + 1, len(actions)):
                 if redundant: break
                 move2, pre2, eff2 = actions[j]
                 gain2 = [{eff2[i]} & target[i] for i in range(4)]
-                redundant |= (gain1 <= gain2)
+                redundant |= all(g1 <= g2 for (g1, g2) in zip(gain1, gain2))
             if not redundant:
                 pre = [pre[i] | {pre1[i]} for i in range(4)]
                 eff = [eff[i] | {eff1[i]} for i in range(4)]
@@ -140,16 +559,7 @@ def h_ff2(state, fline, walls):
     :param walls: the walls that cannot be crossed
     :return: an approximate number of steps needed to reach the finish line
     """
-    global cached_states
-    if state not in cached_states:
-        # If the state has not been cached yet, we calculate the number of needed
-        # steps and cache it.
-        solution = ff2(state, fline, walls)
-        if solution == False:
-            cached_states[state] = math.inf
-        else:
-            cached_states[state] = sum([len(e) for e in solution])
-    return cached_states[state]
+    return ff_memo_value('ff2', state, fline, walls, 2, 'ff')
 
 
 def ff2(state, fline, walls):
@@ -159,6 +569,23 @@ def ff2(state, fline, walls):
     :param walls: the walls that cannot be crossed
     :return: a list of moves that when applied to the starting state r-satisfy the goal
     """
+    # This uses a relaxed planning graph for state-variable representation 2, whose facts
+    # are the locations and velocities.
+    graph = RelaxedGraph(state, fline, walls, 2)
+    if graph.expand() is None: return False
+    return graph.extract()
+
+
+def ff2_product(state, fline, walls):
+    """
+    The older version of ff2, which builds each layer from the Cartesian product of the
+    values reached so far. Its layers are the same as ff2's, but it is much slower, and it
+    extracts the relaxed solution differently, so the number of moves may differ.
+    :param state: the starting state
+    :param fline: the finish line
+    :param walls: the walls that cannot be crossed
+    :return: a list of moves that when applied to the starting state r-satisfy the goal
+    """
 
     # We first change the state to state variable representation 2. Note that I don't use
     # exactly the same representation as given in the project writeup. In the code below
@@ -179,16 +606,24 @@ def ff2(state, fline, walls):
     # until a subset of the curent state r-satisfies the goal.
     # curr, prev store the combinations of the the values of the two state variables
     curr, prev = {((x0, y0), (u0, v0))}, set()
+    warr = racetrack.wall_array(walls)
     while not all(achieved):
         explored.append(state)
         actions = []
         # use curr - prev to avoid expanding the same value combination multiple times
+        candidates = []
         for p, z in curr - prev:
             for m in [(du, dv) for du in [-1, 0, 1] for dv in [-1, 0, 1]]:
                 _p, _z = (p[0] + z[0] + m[0], p[1] + z[1] + m[1]), (z[0] + m[0], z[1] + m[1])
-                if (_p, _z) in curr or racetrack.crash((p, _p), walls): continue
-                state = [state[0] | {_p}, state[1] | {_z}]
-                actions.append((m, (p, z), (_p, _z)))
+                if (_p, _z) not in curr:
+                    candidates.append((m, (p, z), (_p, _z)))
+        # test all of the layer's candidate moves against the walls at once
+        crashes = racetrack.crash_mask([(a[1][0], a[2][0]) for a in candidates], warr)
+        for (a, crashed) in zip(candidates, crashes):
+            if crashed: continue
+            _p, _z = a[2]
+            state = [state[0] | {_p}, state[1] | {_z}]
+            actions.append(a)
         # If the current state and the next state are the same, then there exists no solution,
         # so we return false
         if not actions: return False
@@ -220,12 +655,12 @@ def ff2(state, fline, walls):
             # we can throw away all actions that either do not make progress towards the goal or make
             # no more progress than another action. The variable redundant denotes whether the action
             # can be thrown.
-            redundant = gain1 <= gain
+            redundant = all(g1 <= g for (g1, g) in zip(gain1, gain))
             for j in range(i + 1, len(actions)):
                 if redundant: break
                 move2, pre2, eff2 = actions[j]
                 gain2 = [{eff2[0]} & target[0], {eff2[1]} & target[1]]
-                redundant |= (gain1 <= gain2)
+                redundant |= all(g1 <= g2 for (g1, g2) in zip(gain1, gain2))
             if not redundant:
                 pre = [pre[0] | {pre1[0]}, pre[1] | {pre1[1]}]
                 eff = [eff[0] | {eff1[0]}, eff[1] | {eff1[1]}]
@@ -270,6 +705,123 @@ infinity = float('inf')
 
 g_fline, g_walls, grid = False, False, []
 
+# If edist_cache_dir is set to a directory, edist grids are saved there, one .npy file per
+# track, named by a hash of the finish line and walls (see track_fingerprint). Any process
+# that needs the grid for the same track can then load it from there instead of
+# recomputing it. It's off by default; a user cache directory such as
+# os.path.expanduser('~/.cache/racetrack') is a good place for it.
+edist_cache_dir = None
+
+# h_walldist, h_ff1 and h_ff2 keep what they compute for a track in a
+# TrackContext. The contexts of recently used tracks are kept in track_contexts, least
+# recently used first, so that switching back and forth between tracks doesn't recompute
+# anything. When their estimated size goes over context_budget bytes, the least recently
+# used ones are thrown away. The budget also covers the moves that the RelaxedGraphs keep
+# in racetrack's MoveTables (see trim_contexts). trim_contexts is called whenever something
+# is added to a context. With the default sizes, ff_memo_size for a few heuristics and
+# relaxed_graphs_size large graphs fit in context_budget with room for about 100000 moves.
+# context_stats counts lookups that found a context (hits), that had to create one
+# (misses), and contexts thrown away (evictions).
+context_budget = 256 * 2 ** 20
+track_contexts = OrderedDict()
+context_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+last_context = None
+
+
+class TrackContext:
+    """
+    What the heuristics remember about one track: its edist grid, which is None until
+    h_walldist needs it, and a dict of state values for each heuristic that caches them.
+    """
+    __slots__ = ('key', 'fline', 'walls', 'grid', 'values')
+
+    def __init__(self, key, fline, walls):
+        self.key = key
+        self.fline = fline
+        self.walls = walls
+        self.grid = None
+        self.values = {}
+
+    def nbytes(self):
+        # rough estimate: a grid cell is a float plus a list slot, a cached value is a dict
+        # entry plus the state's nested tuples, and a RelaxedGraph has its layers and
+        # achievers (see RelaxedGraph.nbytes). Pattern databases are numpy arrays.
+        cells = len(self.grid) * len(self.grid[0]) if self.grid else 0
+        tables = sum(t.nbytes for t in self.values.get('pdb', {}).values())
+        graphs = sum(g.nbytes() for g in self.values.get('graphs', {}).values())
+        return 32 * cells + tables + graphs + sum(len(d) * 250 for (name, d) in self.values.items()
+                                                  if name not in ('pdb', 'graphs'))
+
+    def shrink(self):
+        """
+        Forget the older half of each of the context's memos and graphs, and return
+        False if there was nothing to forget. The grid and pattern databases are kept.
+        """
+        shrunk = False
+        for (name, d) in self.values.items():
+            if name != 'pdb' and d:
+                for i in range((len(d) + 1) // 2):
+                    d.popitem(last=False)
+                shrunk = True
+        return shrunk
+
+
+def track_context(fline, walls):
+    """
+    Return the TrackContext for the track with finish line fline and walls walls,
+    creating it if there isn't one. Consecutive calls with the same fline and walls
+    objects don't need to recompute the track's fingerprint.
+    """
+    global last_context
+    ctx = last_context
+    if ctx is not None and ctx.fline is fline and ctx.walls is walls:
+        context_stats['hits'] += 1
+        return ctx
+    key = track_fingerprint(fline, walls)
+    if key in track_contexts:
+        context_stats['hits'] += 1
+        ctx = track_contexts[key]
+        track_contexts.move_to_end(key)
+    else:
+        context_stats['misses'] += 1
+        ctx = TrackContext(key, fline, walls)
+        track_contexts[key] = ctx
+        trim_contexts()
+    ctx.fline, ctx.walls = fline, walls
+    last_context = ctx
+    return ctx
+
+
+def trim_contexts():
+    """
+    Throw away least recently used contexts until the rest, and the moves kept in
+    racetrack's MoveTables (about 1300 bytes for each (x, y, u, v) tuple), fit in
+    context_budget. The most recently used context is always kept; if it doesn't fit by
+    itself, the MoveTables are cleared, and then its memos and graphs are cut down.
+    """
+    moves = 1300 * sum(len(t.moves) for t in racetrack.move_tables.values())
+    total = moves + sum(ctx.nbytes() for ctx in track_contexts.values())
+    while total > context_budget and len(track_contexts) > 1:
+        (key, ctx) = track_contexts.popitem(last=False)
+        total -= ctx.nbytes()
+        context_stats['evictions'] += 1
+    if total > context_budget and moves:
+        racetrack.clear_move_tables()
+        total -= moves
+    if total > context_budget and track_contexts:
+        ctx = next(reversed(track_contexts.values()))
+        while ctx.nbytes() > context_budget and ctx.shrink():
+            pass
+
+
+def clear_track_contexts():
+    # forget all of the track contexts, and reset context_stats
+    global last_context
+    track_contexts.clear()
+    last_context = None
+    for k in context_stats:
+        context_stats[k] = 0
+
 
 def h_walldist(state, fline, walls):
     """
@@ -281,11 +833,12 @@ def h_walldist(state, fline, walls):
     On all subsequent calls, this function will retrieve the cached value and add an
     estimate of how long it will take to stop. 
     """
-    global g_fline, g_walls
-    if fline != g_fline or walls != g_walls or grid == []:
-        edist_grid(fline, walls)
+    ctx = track_context(fline, walls)
+    if ctx.grid is None:
+        ctx.grid = edist_grid(fline, walls)
+        trim_contexts()
     ((x, y), (u, v)) = state
-    hval = float(grid[x][y])
+    hval = float(ctx.grid[x][y])
 
     # add a small penalty to favor short stopping distances
     au = abs(u)
@@ -306,7 +859,58 @@ def h_walldist(state, fline, walls):
     return hval
 
 
-def edist_grid(fline, walls):
+def edist_grid(fline, walls, use_cache=True):
+    """
+    Compute a grid of approximate distances to the finish line that go around walls.
+    Each cell starts with its straight-line distance to the finish line (edistw_to_line),
+    and Dijkstra's algorithm spreads these values outward, one step (1 or sqrt 2) at a
+    time, so each cell is finalized once instead of being swept over repeatedly.
+    """
+    global grid, g_fline, g_walls, xmax, ymax
+    path = edist_cache_path(fline, walls) if use_cache else None
+    if path and os.path.exists(path):
+        grid = numpy.load(path).tolist()
+        xmax, ymax = len(grid) - 1, len(grid[0]) - 1
+        g_fline = fline
+        g_walls = walls
+        print('loaded edist grid from', path)
+        return grid
+    t = time.time()
+    xmax = max([max(x, x1) for ((x, y), (x1, y1)) in walls])
+    ymax = max([max(y, y1) for ((x, y), (x1, y1)) in walls])
+    grid = [[edistw_to_line((x, y), fline, walls) for y in range(ymax + 1)] for x in range(xmax + 1)]
+    print('computing edist grid', end=' ')
+    sys.stdout.flush()
+    queue = [(grid[x][y], x, y) for x in range(xmax + 1) for y in range(ymax + 1) if grid[x][y] != infinity]
+    heapq.heapify(queue)
+    relaxations = 0
+    while queue:
+        (d1, x1, y1) = heapq.heappop(queue)
+        if d1 > grid[x1][y1]:
+            continue        # (x1,y1) was already finalized with a smaller value
+        for x in range(max(0, x1 - 1), min(xmax + 1, x1 + 2)):
+            for y in range(max(0, y1 - 1), min(ymax + 1, y1 + 2)):
+                if x == x1 or y == y1:
+                    d = d1 + 1
+                else:
+                    d = d1 + 1.4142135623730951
+                relaxations += 1
+                if d < grid[x][y] and not racetrack.crash(((x, y), (x1, y1)), walls):
+                    grid[x][y] = d
+                    heapq.heappush(queue, (d, x, y))
+    print('done ({} relaxations, {:.2f} seconds)'.format(relaxations, time.time() - t))
+    g_fline = fline
+    g_walls = walls
+    if path:
+        save_edist_grid(path, grid)
+    return grid
+
+
+def edist_grid_sweeps(fline, walls):
+    """
+    The older version of edist_grid, which sweeps over the whole grid until nothing
+    changes. It gives the same grid as edist_grid (see check_edist_grid) but is much slower.
+    """
     global grid, g_fline, g_walls, xmax, ymax
     xmax = max([max(x, x1) for ((x, y), (x1, y1)) in walls])
     ymax = max([max(y, y1) for ((x, y), (x1, y1)) in walls])
@@ -330,12 +934,200 @@ def edist_grid(fline, walls):
                             if d < grid[x][y]:
                                 grid[x][y] = d
                                 flag = True
-    print('done')
+    print(' done')
     g_fline = fline
     g_walls = walls
     return grid
 
 
+def track_fingerprint(fline, walls):
+    """
+    Return a hash of the finish line and walls, which identifies the track's edist grid.
+    Tracks with the same finish line and walls in the same order get the same fingerprint,
+    whether the points are tuples or lists.
+    """
+    edges = [fline] + list(walls)
+    text = repr([(tuple(p1), tuple(p2)) for (p1, p2) in edges])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def edist_cache_path(fline, walls):
+    # where the track's grid is (or would be) saved, or None if there's no cache directory
+    if not edist_cache_dir:
+        return None
+    return os.path.join(edist_cache_dir, track_fingerprint(fline, walls) + '.npy')
+
+
+def save_edist_grid(path, grid):
+    """
+    Save grid as a .npy file at path. It's written to a temporary file first and then
+    renamed, so that another process never loads a partly written grid.
+    """
+    save_array(path, numpy.array(grid, dtype=float), 'edist grid')
+
+
+def save_array(path, array, what):
+    # save array at path as described in save_edist_grid; what says what it is, for errors
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            numpy.save(f, array)
+        os.replace(tmp, path)
+    except OSError as e:
+        print('could not save {}:'.format(what), e)
+
+
+def check_edist_grid(problems):
+    """
+    Check that edist_grid and edist_grid_sweeps compute identical grids. problems is a
+    list of problems of the form (p0, fline, walls), such as the ones in sample_probs.
+    Return the number of problems on which they disagree.
+    """
+    disagree = 0
+    for (p0, fline, walls) in problems:
+        if edist_grid(fline, walls, use_cache=False) != edist_grid_sweeps(fline, walls):
+            disagree += 1
+    print('check_edist_grid: {} problems, {} disagreements'.format(len(problems), disagree))
+    return disagree
+
+
+# h_pdb's pattern database for a track holds the number of moves from every state whose
+# speeds |u| and |v| are at most the table's speed, computed by a backward breadth-first
+# search from the goal states that never goes faster than that. If pdb_max_speed is None,
+# the speed is reachable_speed(walls). No state that can reach the goal is faster than
+# that, so the table is exact, and h_pdb returns infinity for the states that aren't in
+# it or can't reach the goal (the -1 entries). A smaller pdb_max_speed makes the table
+# smaller, but then the paths in it can't go faster than pdb_max_speed, so some of its
+# entries are too large, and h_pdb is no longer admissible. In that case h_pdb returns
+# pdb_bound for the states outside of the table and the -1 entries.
+pdb_max_speed = None
+
+
+def h_pdb(state, fline, walls):
+    """
+    Look up the number of moves from state to the goal in the track's pattern database,
+    computing the database the first time. If state isn't in the database, or can't reach
+    the goal without going faster than the database's speed, return infinity if the
+    database is exact (pdb_max_speed is None), and pdb_bound(state, fline) otherwise.
+    """
+    (table, m) = track_pdb(fline, walls)
+    ((x, y), (u, v)) = state
+    if abs(u) <= m and abs(v) <= m and 0 <= x < table.shape[0] and 0 <= y < table.shape[1]:
+        d = table[x, y, u + m, v + m]
+        if d >= 0:
+            return int(d)
+    if pdb_max_speed is None:
+        return math.inf
+    return pdb_bound(state, fline)
+
+
+def track_pdb(fline, walls):
+    """
+    Return (table, m), where table is the track's pattern database for the speed m that
+    pdb_max_speed calls for. It's computed the first time, and kept in the track's
+    TrackContext after that.
+    """
+    m = pdb_max_speed or reachable_speed(walls)
+    ctx = track_context(fline, walls)
+    tables = ctx.values.setdefault('pdb', {})
+    if m not in tables:
+        tables[m] = pdb_table(fline, walls, m)
+        trim_contexts()
+    return (tables[m], m)
+
+
+def reachable_speed(walls):
+    """
+    Return the largest speed |u| or |v| that a car on the track can have and still stop
+    before it leaves the track. Stopping from speed k takes moves at speeds of at least
+    k-1, k-2, ..., 0, which cover k(k-1)/2 squares.
+    """
+    size = max([max(x, y, x1, y1) for ((x, y), (x1, y1)) in walls])
+    k = 0
+    while (k + 1) * k // 2 <= size:
+        k += 1
+    return k
+
+
+def pdb_bound(state, fline):
+    """
+    Return a lower bound on the number of moves from state to the goal: the fewest moves
+    that can get the car to a point on the finish line, and stop it there, if there were
+    no walls (see landmarks.axis_bound). h_pdb uses it when pdb_max_speed limits the
+    pattern database.
+    """
+    ((x, y), (u, v)) = state
+    return min(max(landmarks.axis_bound(gx - x, u), landmarks.axis_bound(gy - y, v))
+               for (gx, gy) in landmarks.line_points(fline))
+
+
+def pdb_table(fline, walls, max_speed, use_cache=True):
+    """
+    Return the pattern database for the track and max_speed: an int16 numpy array t such
+    that t[x, y, u + max_speed, v + max_speed] is the fewest moves from ((x,y), (u,v)) to
+    the goal that never go faster than max_speed, or -1 if there's no such path. If
+    max_speed is at least reachable_speed(walls), these are the exact numbers of moves.
+    If use_cache is true, a table saved in edist_cache_dir for the same track and
+    max_speed is loaded instead, and a newly computed table is saved there.
+    """
+    path = None
+    if use_cache and edist_cache_dir:
+        name = '{}-pdb{}.npy'.format(track_fingerprint(fline, walls), max_speed)
+        path = os.path.join(edist_cache_dir, name)
+        if os.path.exists(path):
+            print('loaded pattern database from', path)
+            return numpy.load(path)
+    t = time.time()
+    print('computing pattern database', end=' ')
+    sys.stdout.flush()
+    m = max_speed
+    n = 2 * m + 1
+    xsize = 1 + max([max(x, x1) for ((x, y), (x1, y1)) in walls])
+    ysize = 1 + max([max(y, y1) for ((x, y), (x1, y1)) in walls])
+
+    # ok[x, y, du + m, dv + m] tells whether moving from (x,y) to (x+du, y+dv) is legal
+    (xs, ys, us, vs) = (a.ravel() for a in numpy.meshgrid(
+        numpy.arange(xsize), numpy.arange(ysize), numpy.arange(-m, m + 1), numpy.arange(-m, m + 1), indexing='ij'))
+    moves = numpy.stack([xs, ys, xs + us, ys + vs], axis=1)
+    ok = (xs + us >= 0) & (xs + us < xsize) & (ys + vs >= 0) & (ys + vs < ysize)
+    warr = racetrack.wall_array(walls)
+    for i in range(0, len(moves), 4096):
+        ok[i:i + 4096] &= ~racetrack.crash_mask(moves[i:i + 4096], warr)
+    ok = ok.reshape(xsize, ysize, n, n)
+
+    # Backward breadth-first search. To arrive at ((x,y), (u,v)), the previous location
+    # must have been (x-u, y-v), and the previous velocity (u-du, v-dv) for one of the 9
+    # accelerations (du,dv). All 9 of them use the same move.
+    dist = numpy.full((xsize, ysize, n, n), -1, dtype=numpy.int16)
+    for ((x, y), z) in racetrack.goal_states(fline):
+        dist[x, y, m, m] = 0
+    frontier = numpy.argwhere(dist == 0)
+    d = 0
+    while len(frontier):
+        (x, y, iu, iv) = frontier.T
+        (px, py) = (x - (iu - m), y - (iv - m))
+        keep = (px >= 0) & (px < xsize) & (py >= 0) & (py < ysize)
+        (px, py, iu, iv) = (px[keep], py[keep], iu[keep], iv[keep])
+        keep = ok[px, py, iu, iv]
+        (px, py, iu, iv) = (px[keep], py[keep], iu[keep], iv[keep])
+        reached = numpy.zeros(dist.shape, dtype=bool)
+        for du in [-1, 0, 1]:
+            for dv in [-1, 0, 1]:
+                (pu, pv) = (iu - du, iv - dv)
+                keep = (pu >= 0) & (pu < n) & (pv >= 0) & (pv < n)
+                reached[px[keep], py[keep], pu[keep], pv[keep]] = True
+        reached &= dist < 0
+        d += 1
+        dist[reached] = d
+        frontier = numpy.argwhere(reached)
+    print('done ({} states, {} can reach the goal, {} bytes, {:.2f} seconds)'.format(
+        dist.size, int((dist >= 0).sum()), dist.nbytes, time.time() - t))
+    if path:
+        save_array(path, dist, 'pattern database')
+    return dist
+
+
 def edistw_to_line(point, edge, walls):
     """
     straight-line distance from (x,y) to the line ((x1,y1),(x2,y2)).
@@ -367,4 +1159,7 @@ def tear_down():
     global g_fline, g_walls
     g_fline, g_walls = False, False
     grid.clear()
-    cached_states.clear()
+    clear_track_contexts()
+    racetrack.clear_move_tables()
+    for k in ff_memo_stats:
+        ff_memo_stats[k] = 0
@@ -0,0 +1,239 @@
+"""
+File: landmarks.py
+
+A landmark (ALT) heuristic for racetrack problems. For each track, we pick a few
+landmarks -- the finish line, and the corridor ends farthest away from it -- and compute
+the distance from every landmark to every grid point, where a distance is the number of
+king moves (one step in any of the 8 directions, not through a wall). By the triangle
+inequality, for a landmark L, a point p and a finish line G,
+    d(p,G) >= d(L,p) - max d(L,g)   and   d(p,G) >= min d(L,g) - d(L,p),
+with g ranging over the points of G. h_alt takes the largest of these bounds and turns it
+into a lower bound on the number of moves, using the fact that a car can't speed up or
+slow down by more than 1 per move (see moves_bound). So unlike h_walldist, h_alt is
+admissible (check_landmarks tests this against exact move counts), and A* with it
+returns optimal paths.
+
+The tables only depend on the walls, so a track that is used with several finish lines
+shares one set of tables; only the first finish line is used as a landmark.
+"""
+
+import math
+import time
+import numpy
+import racetrack
+
+
+# number of landmarks, not counting the finish line
+landmark_count = 4
+
+# the 8 king moves
+directions = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+class LandmarkTables:
+    """
+    The landmarks of one list of walls. ok[x, y, k] tells whether the king move
+    directions[k] from (x,y) is legal, and dist[i, x, y] is the distance from landmark
+    i to (x,y), or -1 if (x,y) can't be reached from it. lines holds a grid of distance
+    bounds and the list of grid points for each finish line that h_alt has been called
+    with.
+    """
+
+    def __init__(self, fline, walls, count):
+        t = time.time()
+        self.ok = step_table(walls)
+        (xsize, ysize) = self.ok.shape[:2]
+        line = king_distances(self.ok, line_points(fline))
+        self.points = [fline] + choose_landmarks(self.ok, line, count)
+        self.dist = numpy.stack([line] + [king_distances(self.ok, [p]) for p in self.points[1:]])
+        self.lines = {}
+        print('computed {} landmarks ({} bytes, {:.2f} seconds)'.format(
+            len(self.points), self.dist.nbytes, time.time() - t))
+
+    def line_bounds(self, fline):
+        """
+        Return (b, points), where points are the grid points on fline and b is a float
+        array such that b[x, y] is a lower bound on the distance from (x,y) to fline, or
+        infinity if (x,y) can't reach it.
+        """
+        key = tuple(map(tuple, fline))
+        if key not in self.lines:
+            points = line_points(fline)
+            (gx, gy) = numpy.array(points).T
+            b = numpy.zeros(self.dist.shape[1:])
+            for d in self.dist:
+                g = d[gx, gy]
+                if (g < 0).any():
+                    continue    # the landmark is in another part of the track
+                b = numpy.maximum(b, numpy.maximum(d - g.max(), g.min() - d))
+                b[d < 0] = math.inf
+            self.lines[key] = (b, points)
+        return self.lines[key]
+
+
+# LandmarkTables for the tracks we've seen, keyed by the walls
+landmark_tables = {}
+last_tables = None
+
+
+def get_tables(fline, walls):
+    """
+    Return the LandmarkTables for walls, creating them (with fline as the first
+    landmark) if necessary. Like racetrack.move_table, the tables are keyed by the
+    contents of walls; consecutive calls with the same walls object skip that.
+    """
+    global last_tables
+    if last_tables is not None and last_tables[0] is walls:
+        return last_tables[1]
+    key = tuple((tuple(a), tuple(b)) for (a, b) in walls)
+    if key not in landmark_tables:
+        landmark_tables[key] = LandmarkTables(fline, walls, landmark_count)
+    last_tables = (walls, landmark_tables[key])
+    return landmark_tables[key]
+
+
+def clear_landmark_tables():
+    global last_tables
+    landmark_tables.clear()
+    last_tables = None
+
+
+def h_alt(state, fline, walls):
+    """
+    Return a lower bound on the number of moves from state to the goal: the fewest moves
+    that can cover the landmarks' distance bound, starting at state's speed and ending
+    at speed 0, or the fewest moves that can get to a point on the finish line if there
+    were no walls, whichever is larger.
+    """
+    (b, points) = get_tables(fline, walls).line_bounds(fline)
+    ((x, y), (u, v)) = state
+    if not (0 <= x < b.shape[0] and 0 <= y < b.shape[1]):
+        return 0
+    d = b[x, y]
+    if d == math.inf:
+        return math.inf
+    n = min(max(axis_bound(gx - x, u), axis_bound(gy - y, v)) for (gx, gy) in points)
+    return max(n, moves_bound(int(d), max(abs(u), abs(v))))
+
+
+moves_bounds = {}
+
+
+def moves_bound(d, speed):
+    """
+    Return the fewest moves n that can cover a distance of d king moves, starting at
+    speed speed (measured as max(|u|,|v|)) and ending at speed 0. In move k, the car's
+    speed is at most speed + k, and also at most n - k since it has to be 0 after move n.
+    """
+    key = (d, speed)
+    if key not in moves_bounds:
+        n = speed
+        while sum(min(speed + k, n - k) for k in range(1, n + 1)) < d:
+            n += 1
+        moves_bounds[key] = n
+    return moves_bounds[key]
+
+
+axis_bounds = {}
+
+
+def axis_bound(d, u):
+    """
+    Return the fewest moves n that can move the car d units along one axis, starting at
+    velocity u along that axis and ending at velocity 0. The velocity in move k is
+    between u - k and u + k, and between k - n and n - k.
+    """
+    key = (d, u)
+    if key not in axis_bounds:
+        n = abs(u)
+        while not (sum(max(u - k, k - n) for k in range(1, n + 1)) <= d
+                   <= sum(min(u + k, n - k) for k in range(1, n + 1))):
+            n += 1
+        axis_bounds[key] = n
+    return axis_bounds[key]
+
+
+def line_points(fline):
+    """Return the grid points on the finish line fline"""
+    return [p for (p, z) in racetrack.goal_states(fline)]
+
+
+def step_table(walls):
+    """
+    Return a bool array ok such that ok[x, y, k] tells whether the king move
+    directions[k] from (x,y) stays on the grid and doesn't crash into a wall.
+    """
+    xsize = 1 + max([max(x, x1) for ((x, y), (x1, y1)) in walls])
+    ysize = 1 + max([max(y, y1) for ((x, y), (x1, y1)) in walls])
+    (xs, ys, ks) = (a.ravel() for a in numpy.meshgrid(
+        numpy.arange(xsize), numpy.arange(ysize), numpy.arange(len(directions)), indexing='ij'))
+    (dx, dy) = numpy.array(directions).T
+    (x1, y1) = (xs + dx[ks], ys + dy[ks])
+    ok = (x1 >= 0) & (x1 < xsize) & (y1 >= 0) & (y1 < ysize)
+    ok &= ~racetrack.crash_mask(numpy.stack([xs, ys, x1, y1], axis=1), racetrack.wall_array(walls))
+    return ok.reshape(xsize, ysize, len(directions))
+
+
+def king_distances(ok, sources):
+    """
+    Breadth-first search from the points in sources. Return an int32 array giving the
+    distance (in king moves) from the nearest source to each grid point, or -1 for the
+    points that can't be reached.
+    """
+    dist = numpy.full(ok.shape[:2], -1, dtype=numpy.int32)
+    for (x, y) in sources:
+        dist[x, y] = 0
+    frontier = numpy.argwhere(dist == 0)
+    d = 0
+    while len(frontier):
+        (x, y) = frontier.T
+        reached = numpy.zeros(dist.shape, dtype=bool)
+        for (k, (dx, dy)) in enumerate(directions):
+            keep = ok[x, y, k]
+            reached[x[keep] + dx, y[keep] + dy] = True
+        reached &= dist < 0
+        d += 1
+        dist[reached] = d
+        frontier = numpy.argwhere(reached)
+    return dist
+
+
+def choose_landmarks(ok, line, count):
+    """
+    Choose count landmarks by farthest-point selection: each one is the grid point that
+    is farthest from the finish line and the landmarks chosen before it. line is the
+    distance array for the finish line. On a maze, this picks the ends of the corridors
+    that are farthest away, which is where the bounds are the best.
+    """
+    nearest = numpy.where(line < 0, -1, line)
+    points = []
+    for i in range(count):
+        (x, y) = numpy.unravel_index(numpy.argmax(nearest), nearest.shape)
+        if nearest[x, y] <= 0:
+            break
+        points.append((int(x), int(y)))
+        nearest = numpy.minimum(nearest, king_distances(ok, [(x, y)]))
+    return points
+
+
+def check_landmarks(problems, max_speed=None):
+    """
+    For each problem, compare h_alt with the exact number of moves from every state
+    whose speed is at most max_speed, which is computed by heuristics.pdb_table (the
+    default max_speed is the size of the track, so nothing is left out). Print the number
+    of states where h_alt is larger than the exact value -- there shouldn't be any --
+    and the average ratio of the two.
+    """
+    import heuristics
+    for p in problems:
+        (fline, walls) = (p[1], p[2])
+        m = max_speed or 1 + max([max(abs(x), abs(y)) for wall in walls for (x, y) in wall])
+        exact = heuristics.pdb_table(fline, walls, m, use_cache=False)
+        (bad, ratio, count) = (0, 0, 0)
+        for (x, y, iu, iv) in numpy.argwhere(exact > 0):
+            h = h_alt(((int(x), int(y)), (int(iu) - m, int(iv) - m)), fline, walls)
+            bad += h > exact[x, y, iu, iv]
+            ratio += h / exact[x, y, iu, iv]
+            count += 1
+        print('{} states, h_alt too large in {}, h_alt/exact = {:.2f} on average'.format(
+            count, bad, ratio / max(count, 1)))
@@ -0,0 +1,31 @@
+"""
+File: bench_ilao.py
+
+Compares the two modes of proj2a.main, LAO* and ILAO*, on the problems that supervisor.py
+uses. For each problem and mode, it runs proj2a.main from the starting state until it
+finishes, and prints the running time, proj2a.lao_stats (iterations, expansions and
+Bellman backups) and the expected cost of the starting state.
+"""
+import time, random
+import proj2a
+from sample_probs import *
+
+# don't write the cache file, so that the running times only measure the search
+proj2a.update_cache = lambda: None
+
+names = ["wall8a", "wall8b", "rectwall8", "rhook16a", "rhook16b", "spiral16", "rectwall16", "lhook16",
+         "rect20a", "rect20b", "rect20c", "rect20d", "rect20e", "spiral24", "pdes30", "pdes30b", "rect50"]
+
+for name in names:
+    (p0, f_line, walls) = globals()[name]
+    s = (p0, (0, 0))
+    print(name + ':')
+    for ilao in [False, True]:
+        proj2a.use_ilao = ilao
+        random.seed(0)
+        t = time.time()
+        proj2a.main(s, f_line, walls)
+        t = time.time() - t
+        print('    {:5} {:>6.2f} seconds, {:>5} iterations, {:>5} expansions, {:>6} backups, value {:.2f}'.format(
+            ('ILAO*' if ilao else 'LAO*'), t, proj2a.lao_stats['iterations'], proj2a.lao_stats['expansions'],
+            proj2a.lao_stats['backups'], proj2a.values[s]))
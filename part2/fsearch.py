@@ -3,14 +3,19 @@ File: fsearch.py -- Dana Nau <nau@cs.umd.edu>, Feb 14, 2018
 
 The main program in this file is a version of Deterministic-forward-search:
 
-main(s0, next_states, goal_test, strategy, h = lambda s: 0, verbose=2, draw_edges=None)
+main(s0, next_states, goal_test, strategy, h = lambda s: 0, verbose=2, draw_edges=None,
+     track_children=True, pack=None, unpack=None, weight=2, solution_callback=None)
 
  - s0: initial state.
  - next_states(s): user-supplied function to generate a list of successors of state s.
 
- - strategy: the search strategy. It should be one of these: 
+ - strategy: the search strategy. It should be one of these:
    'bf' (best first), 'df' (depth first),
-   'uc' (uniform cost), 'gbf' (greedy best first), or 'a*'.
+   'uc' (uniform cost), 'gbf' (greedy best first), 'a*',
+   'ida*' (iterative-deepening A*, which uses memory linear in the solution depth),
+   'wa*' (weighted A*, which orders the frontier by g + weight*h), or
+   'ara*' (anytime repairing A*, which does weighted A* searches with smaller and
+   smaller weights, starting at weight and ending at 1).
 
  - h(s): user-supplied heuristic function.
 
@@ -26,34 +31,79 @@ main(s0, next_states, goal_test, strategy, h = lambda s: 0, verbose=2, draw_edge
     - edges, a list of edges.
     - status, a string that indicates what kind of edges they are:
       'expand', 'add', 'discard', 'frontier_prune', 'explored_prune', and 'solution'.
+
+ - track_children: whether each node should keep a list of its children. Nothing in
+   this file uses the lists, and turning them off lets the garbage collector reclaim
+   the parts of the search tree that are no longer reachable from explored or frontier.
+
+ - pack(s), unpack(p): optional user-supplied functions to convert a state to and from
+   a more compact form. If they're given, each node stores pack(s) instead of s, and the
+   other user-supplied functions still get unpacked states.
+
+ - weight: the weight on h for 'wa*', and the starting weight for 'ara*'.
+
+ - solution_callback(path, cost, bound): optional user-supplied function for 'ara*'.
+   It's called each time 'ara*' finds a better solution or a tighter bound, where
+   path is a list of states and bound is an upper bound on cost/(optimal cost).
+   This gives the caller a usable answer even if the search gets cut off. The bound
+   only holds if h is admissible; with an inadmissible h, 'ara*' may report bound 1
+   for a solution that isn't optimal.
+
+There's also a bidirectional search program, which needs the goal states and a way to
+generate predecessors rather than a goal test:
+
+bidirectional(s0, goals, next_states, previous_states, verbose=2, draw_edges=None)
+
+ - goals: a list of all the goal states.
+ - previous_states(s): user-supplied function to generate a list of (p, cost) pairs,
+   one for each state p such that next_states(p) contains (s, cost).
 """
 
 import sys  # We need flush() and readline()
+import heapq  # priority queue for the frontier
+
+
+class Search:
+    """
+    Bookkeeping for one call to main: counters, and the options that tell how to store
+    nodes. Each search gets its own Search object, so searches don't share counters.
+    """
+
+    def __init__(self, track_children=True, pack=None, unpack=None):
+        self.node_count = 0  # total number of generated nodes
+        self.comparisons_saved = 0  # state comparisons avoided by looking states up in dicts
+        self.track_children = track_children
+        self.pack = pack or (lambda s: s)
+        self.unpack = unpack or (lambda s: s)
 
 
-class Node():
+class Node:
     """
-    Each node includes ID#, state, parent node, g-values, h-values, and list of children.
+    Each node includes ID#, state, parent node, g-value, h-value, and list of children
+    (None if the search doesn't track children). Nodes use __slots__ rather than a
+    __dict__, since a big search can generate millions of them.
     """
+    __slots__ = ('state', 'parent', 'id', 'depth', 'g', 'h', 'children')
 
-    def __init__(self, state, parent, cost, h_value):
+    def __init__(self, state, parent, cost, h_value, search):
         """
-        Args: current state, parent node, cost of transition from parent state
-        to current state, and h(current state)
+        Args: current state (packed, if the search packs states), parent node, cost of
+        transition from parent state to current state, h(current state), and the Search
+        object for the search that's generating the node
         """
-        global node_count
         self.state = state
         self.parent = parent
-        node_count += 1  # total number of nodes
-        self.id = node_count  # this node's ID number
+        search.node_count += 1  # total number of nodes
+        self.id = search.node_count  # this node's ID number
         if parent:
-            parent.children.append(self)
+            if parent.children is not None:
+                parent.children.append(self)
             self.depth = parent.depth + 1  # depth in the search tree
             self.g = parent.g + cost  # total accumulated cost
         else:
             self.depth = 0
             self.g = cost
-        self.children = []
+        self.children = [] if search.track_children else None
         self.h = h_value
 
 
@@ -74,11 +124,71 @@ sort_options = {
     'df': ('-id', lambda x: -x.id, '#{0}: d {1}, g {3:.2f}, state {5}'),
     'uc': ('g', lambda x: x.g, '#{0}: g {3:.2f}, d {1}, state {5}'),
     'gbf': ('h', lambda x: x.h, '#{0}: h {4:.2f}, d {1}, g {3:.2f}, state {5}'),
-    'a*': ('f', lambda x: x.g + x.h, '#{0}: f {2:.2f}, g {3:.2f}, h {4:.2f}, d {1}, state {5}')}
+    'a*': ('f', lambda x: x.g + x.h, '#{0}: f {2:.2f}, g {3:.2f}, h {4:.2f}, d {1}, state {5}'),
+    'ida*': ('f', lambda x: x.g + x.h, '#{0}: f {2:.2f}, g {3:.2f}, h {4:.2f}, d {1}, state {5}'),
+    # for 'wa*', main multiplies h by the weight, so x.h is the weighted h-value
+    'wa*': ('g + w*h', lambda x: x.g + x.h, '#{0}: f {2:.2f}, g {3:.2f}, w*h {4:.2f}, d {1}, state {5}'),
+    'ara*': ('f', lambda x: x.g + x.h, '#{0}: f {2:.2f}, g {3:.2f}, h {4:.2f}, d {1}, state {5}')}
+
+
+class Frontier:
+    """
+    The frontier, kept as a binary heap of (key, id, node) entries plus an index that
+    maps each state to the frontier node that contains it. Ties in the key are broken
+    by node ID, which is the same order as the old stable sort of the frontier list
+    (nodes are added to the frontier in the order they're created).
+
+    The pruning rules in expand never leave two frontier nodes with the same state,
+    so the index has one node per state. Pruned nodes are deleted lazily: they are
+    removed from the index, and their heap entries are skipped when they get popped.
+    """
+
+    def __init__(self, key_func, nodes=()):
+        self.key_func = key_func
+        self.heap = []
+        self.index = {}
+        for y in nodes:
+            self.add(y)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(list(self.index.values()))
+
+    def add(self, y):
+        heapq.heappush(self.heap, (self.key_func(y), y.id, y))
+        self.index[y.state] = y
+
+    def pop(self):
+        """Remove and return the node with the smallest key"""
+        while True:
+            (_, _, y) = heapq.heappop(self.heap)
+            if self.index.get(y.state) is y:
+                del self.index[y.state]
+                return y
+
+    def remove(self, y):
+        """Lazy deletion: y's heap entry stays in the heap until it's popped"""
+        del self.index[y.state]
+
+    def get(self, state):
+        """Return the frontier node whose state is state, or None"""
+        return self.index.get(state)
+
+    def top(self):
+        """Return the node with the smallest key, without removing it"""
+        while self.index.get(self.heap[0][2].state) is not self.heap[0][2]:
+            heapq.heappop(self.heap)
+        return self.heap[0][2]
 
+    def nodes(self):
+        """Return a list of the frontier nodes, in the order they'll be popped"""
+        return sorted(self.index.values(), key=lambda y: (self.key_func(y), y.id))
 
-def printnodes(message, nodes, strategy, verbose):
-    """For each node in nodes, print its state and its 'key_func' values"""
+
+def printnodes(message, nodes, strategy, verbose, unpack=lambda s: s):
+    """For each node in nodes, print its state and its 'key_func' value"""
     (key_name, key_func, template) = sort_options[strategy]
     nodes.sort(key=key_func)  # no need to do this unless we're going to print them
 
@@ -97,114 +207,147 @@ def printnodes(message, nodes, strategy, verbose):
         else:
             print('    {:>10} {} nodes:'.format(message, len(nodes)))
         for y in nodes[:10]:
-            print('{:11}{}'.format('', nodeinfo(y, template)))
+            print('{:11}{}'.format('', nodeinfo(y, template, unpack)))
         if len(nodes) > 10:
             print('{:11}{}'.format('', ' and {} more ...'.format(len(nodes) - 10)))
 
 
-def nodeinfo(y, template):
+def nodeinfo(y, template, unpack=lambda s: s):
     """return a one-line description of a node"""
-    return template.format(y.id, y.depth, y.g + y.h, y.g, y.h, y.state)
+    return template.format(y.id, y.depth, y.g + y.h, y.g, y.h, unpack(y.state))
 
 
-def print_nodetypes(new, n_prune, e_prune, f_prune, frontier, strategy, verbose):
-    printnodes('add', new, strategy, verbose)
-    if n_prune: printnodes('discard', n_prune, strategy, verbose)
-    if e_prune: printnodes('expl. rm', e_prune, strategy, verbose)
-    if f_prune: printnodes('fron. rm', f_prune, strategy, verbose)
-    printnodes('frontier', frontier, strategy, verbose)
+def print_nodetypes(new, n_prune, e_prune, f_prune, frontier, strategy, verbose, unpack):
+    printnodes('add', new, strategy, verbose, unpack)
+    if n_prune: printnodes('discard', n_prune, strategy, verbose, unpack)
+    if e_prune: printnodes('expl. rm', e_prune, strategy, verbose, unpack)
+    if f_prune: printnodes('fron. rm', f_prune, strategy, verbose, unpack)
+    printnodes('frontier', frontier, strategy, verbose, unpack)
 
 
-def finish(x, node_count, prunes, frontier, explored, verbose, draw_edges):
+def finish(x, search, prunes, frontier, explored, verbose, draw_edges):
     """called after a successful search, to print info and/or draw the solution"""
     path = getpath(x)
     if verbose >= 1:
         # Path length = number of actions = number of nodes - 1
-        print('==> Path length {}, cost {}.'.format(len(path) - 1, x.g), \
-              'Generated {}, pruned {}, explored {}, frontier {}.'.format( \
-                  node_count, prunes, len(explored), len(frontier)))
+        print('==> Path length {}, cost {}.'.format(len(path) - 1, x.g),
+              'Generated {}, pruned {}, explored {}, frontier {}.'.format(search.node_count, prunes, len(explored), len(frontier)))
+        print('==> Duplicate detection used dict lookups, saving {} state comparisons.'.format(search.comparisons_saved))
     if draw_edges:
-        draw_edges([(x.parent.state[0], x.state[0]) for x in path if x.parent], 'solution')
-    return [p.state for p in path]
+        draw_edges(get_edges(path, search.unpack), 'solution')
+    return [search.unpack(p.state) for p in path]
 
 
-def get_edges(nodes):
-    return [(x.parent.state[0], x.state[0]) for x in nodes if x.parent]
+def get_edges(nodes, unpack=lambda s: s):
+    return [(unpack(x.parent.state)[0], unpack(x.state)[0]) for x in nodes if x.parent]
 
 
-def draw_expand(x, n_prune, new, f_prune, e_prune, draw_edges):
-    draw_edges(get_edges([x]), 'expand')
-    draw_edges(get_edges(n_prune), 'discard')
-    draw_edges(get_edges(new), 'add')
-    draw_edges(get_edges(f_prune), 'frontier_prune')
-    draw_edges(get_edges(e_prune), 'explored_prune')
+def draw_expand(x, n_prune, new, f_prune, e_prune, draw_edges, unpack):
+    draw_edges(get_edges([x], unpack), 'expand')
+    draw_edges(get_edges(n_prune, unpack), 'discard')
+    draw_edges(get_edges(new, unpack), 'add')
+    draw_edges(get_edges(f_prune, unpack), 'frontier_prune')
+    draw_edges(get_edges(e_prune, unpack), 'explored_prune')
 
 
-def expand(x, next_states, h, frontier, explored, strategy, verbose, draw_edges):
+def expand(x, next_states, h, frontier, explored, strategy, verbose, draw_edges, search):
     """
-    Return six lists of nodes: new nodes, nodes pruned from new, frontier nodes,
-    nodes pruned from frontier, explored node, and nodes pruned from explored
+    Return new nodes, nodes pruned from new, the frontier (a Frontier object),
+    nodes pruned from frontier, explored nodes (a dict that maps states to nodes),
+    and nodes pruned from explored
     """
     (key_name, key_func, template) = sort_options[strategy]
-    new = [Node(s, x, cost, h(s)) for (s, cost) in next_states(x.state)]
-
-    # make a list of dominated new nodes, then prune them
-    n_prune = [m for m in new if
-               [n for n in explored if m.state == n.state and key_func(m) >= key_func(n)] or
-               [n for n in frontier if m.state == n.state and key_func(m) >= key_func(n)] or
-               [n for n in new if m.state == n.state and key_func(m) > key_func(n)] or
-               [n for n in new if m.state == n.state and key_func(m) == key_func(n) and m.id > n.id]]
+    new = [Node(search.pack(s), x, cost, h(s), search)
+           for (s, cost) in next_states(search.unpack(x.state))]
+
+    # For each state, find the best new node for it (smallest key, ties broken by ID).
+    # Every other new node with that state is dominated by it.
+    best = {}
+    for m in new:
+        if m.state not in best or key_func(m) < key_func(best[m.state]):
+            best[m.state] = m
+
+    # make a list of dominated new nodes, then prune them. explored and frontier each
+    # have at most one node per state, so a dict lookup replaces a scan of each list.
+    n_prune = []
+    for m in new:
+        n = explored.get(m.state) or frontier.get(m.state)
+        if best[m.state] is not m or (n and key_func(m) >= key_func(n)):
+            n_prune.append(m)
+    generated = len(new)
     new = [m for m in new if not m in n_prune]
 
-    # make a list of dominated frontier nodes, then prune them
-    f_prune = [m for m in frontier if
-               [n for n in new if m.state == n.state and key_func(m) > key_func(n)]]
-    frontier = [m for m in frontier if not m in f_prune]
+    # The old list scans compared each new node with every explored, frontier and new
+    # node, then each explored and frontier node with every remaining new node.
+    scans = (generated + len(new)) * (len(explored) + len(frontier)) + generated ** 2
+    search.comparisons_saved += scans - 2 * (generated + len(new))
+
+    # make a list of dominated frontier nodes, then prune them. If a new node m
+    # survived the test above, any frontier node with m's state has a larger key.
+    # Sorting by (key, ID) gives the same order as the old frontier list.
+    f_prune = [frontier.get(m.state) for m in new if frontier.get(m.state)]
+    f_prune.sort(key=lambda y: (key_func(y), y.id))
+    for m in f_prune:
+        frontier.remove(m)
 
     # make a list of dominated explored nodes, then prune them
-    e_prune = [m for m in explored if
-               [n for n in new if m.state == n.state and key_func(m) > key_func(n)]]
-    explored = [m for m in explored if not m in e_prune]
+    e_prune = [explored[m.state] for m in new if m.state in explored]
+    e_prune.sort(key=lambda y: (key_func(y), y.id))
+    for m in e_prune:
+        del explored[m.state]
 
-    frontier.extend(new)
-    frontier.sort(key=key_func)
+    for m in new:
+        frontier.add(m)
 
     if verbose >= 2:
-        print_nodetypes(new, n_prune, e_prune, f_prune, frontier, strategy, verbose)
+        print_nodetypes(new, n_prune, e_prune, f_prune, frontier.nodes(), strategy, verbose, search.unpack)
     if draw_edges:
-        draw_expand(x, n_prune, new, f_prune, e_prune, draw_edges)
-    return (new, n_prune, frontier, f_prune, explored, e_prune)
+        draw_expand(x, n_prune, new, f_prune, e_prune, draw_edges, search.unpack)
+    return new, n_prune, frontier, f_prune, explored, e_prune
 
 
-def main(s0, next_states, goal_test, strategy, h=None, verbose=2, draw_edges=None):
+def main(s0, next_states, goal_test, strategy, h=None, verbose=2, draw_edges=None,
+         track_children=True, pack=None, unpack=None, weight=2, solution_callback=None):
     """
-    Graph search for a path from s0 (initial state) to a state that satisfies goal_test. 
-    strategy is 'bf', 'df', 'uc', 'gbf', or 'a*'. If verbose >= 1, print some statistics
-    at the end of the search. If verbose >= 2, also print some info at each iteration. If 
-    verbose >= 3, print more info. If verbose >= 4, print info and pause at each iteration.
+    Graph search for a path from s0 (initial state) to a state that satisfies goal_test.
+    strategy is 'bf', 'df', 'uc', 'gbf', 'a*', 'ida*', 'wa*', or 'ara*'. If verbose >= 1,
+    print some statistics at the end of the search. If verbose >= 2, also print some info
+    at each iteration. If verbose >= 3, print more info. If verbose >= 4, print info and
+    pause at each iteration. If track_children is false, nodes don't keep lists of their
+    children. If pack and unpack are given, nodes store packed states. weight and
+    solution_callback are for 'wa*' and 'ara*' (see the top of this file).
     """
-    global node_count
-    node_count = 0  # total number of generated nodes
+    search = Search(track_children, pack, unpack)
+    if strategy == 'ida*':
+        return ida_star(s0, next_states, goal_test, h, verbose, draw_edges, search)
+    if strategy == 'ara*':
+        return ara_star(s0, next_states, goal_test, h, weight, verbose, draw_edges, search,
+                        solution_callback)
+    if strategy == 'wa*':
+        if h is None:
+            h = lambda s: 0
+        unweighted_h = h
+        h = lambda s: weight * unweighted_h(s)
     prunes = 0  # total number of pruned nodes
-    explored = []  # all nodes that have been expanded
+    explored = {}  # maps the state of each expanded node to the node
     (key_name, key_func, template) = sort_options[strategy]
     if verbose >= 2:
         print('==> {} search, keep frontier ordered by {}:\n'.format(strategy, key_name))
-    # Below, thes 2nd arg is None because the node has no parent.
+    # Below, the 2nd arg is None because the node has no parent.
     if h:
-        frontier = [Node(s0, None, 0, h(s0))]
+        frontier = Frontier(key_func, [Node(search.pack(s0), None, 0, h(s0), search)])
     else:
-        frontier = [Node(s0, None, 0, None)]
+        frontier = Frontier(key_func, [Node(search.pack(s0), None, 0, None, search)])
     iteration = 0
     while frontier:
         iteration += 1  # keep track of how many iterations we've done
-        x = frontier.pop(0)  # inefficient
-        explored.append(x)
-        if verbose >= 2: print('{0:>3} Expand'.format(iteration), nodeinfo(x, template))
-        if goal_test(x.state):
-            return finish(x, node_count, prunes, frontier, explored, verbose, draw_edges)
-        (new, n_prune, frontier, f_prune, explored, e_prune) = expand( \
-            x, next_states, h, frontier, explored, strategy, verbose, draw_edges)
+        x = frontier.pop()
+        explored[x.state] = x
+        if verbose >= 2: print('{0:>3} Expand'.format(iteration), nodeinfo(x, template, search.unpack))
+        if goal_test(search.unpack(x.state)):
+            return finish(x, search, prunes, frontier, explored, verbose, draw_edges)
+        (new, n_prune, frontier, f_prune, explored, e_prune) = \
+            expand(x, next_states, h, frontier, explored, strategy, verbose, draw_edges, search)
         if verbose >= 4:
             print("continue > ", end='')
             sys.stdout.flush()
@@ -214,3 +357,229 @@ def main(s0, next_states, goal_test, strategy, h=None, verbose=2, draw_edges=Non
         prunes += len(n_prune) + len(f_prune) + len(e_prune)
     if verbose >= 3: print("==> Couldn't find a solution.")
     return False
+
+
+
+def ida_star(s0, next_states, goal_test, h, verbose, draw_edges, search):
+    """
+    Iterative-deepening A*. Each iteration is a depth-first search that doesn't go past
+    nodes whose f-value exceeds the current threshold; the next iteration's threshold
+    is the smallest f-value that went past it. Only the current path and the unexpanded
+    siblings of its nodes are kept, so there's no explored list. Cycles are avoided by
+    not generating states that are already on the current path.
+    """
+    (key_name, key_func, template) = sort_options['ida*']
+    unpack = search.unpack
+    if h is None:
+        h = lambda s: 0
+    search.track_children = False  # otherwise the root would keep the whole tree alive
+    root = Node(search.pack(s0), None, 0, h(s0), search)
+    threshold = key_func(root)
+    thresholds = []  # for each iteration, (threshold, nodes generated, nodes expanded)
+    while threshold < float('inf'):
+        generated = search.node_count
+        expanded = 0
+        next_threshold = float('inf')
+        if verbose >= 2:
+            print('==> ida* iteration {}, threshold {:.2f}'.format(len(thresholds) + 1, threshold))
+        # Each stack entry is a node on the current path, and a list of its children
+        # that haven't been visited yet (None if the node hasn't been expanded).
+        stack = [(root, None)]
+        on_path = set()
+        solution = None
+        while stack and not solution:
+            (x, children) = stack.pop()
+            if children is None:  # first visit to x
+                if goal_test(unpack(x.state)):
+                    solution = x
+                    break
+                expanded += 1
+                if verbose >= 3: print('{0:>5} Expand'.format(expanded), nodeinfo(x, template, unpack))
+                on_path.add(x.state)
+                children = []
+                for (s, cost) in next_states(unpack(x.state)):
+                    m = Node(search.pack(s), x, cost, h(s), search)
+                    if m.state in on_path:
+                        continue
+                    if key_func(m) > threshold:
+                        next_threshold = min(next_threshold, key_func(m))
+                    else:
+                        children.append(m)
+                # visit the children in order of increasing f (ties broken by ID)
+                children.sort(key=lambda y: (key_func(y), y.id), reverse=True)
+                if draw_edges:
+                    draw_edges(get_edges([x], unpack), 'expand')
+                    draw_edges(get_edges(children, unpack), 'add')
+            if children:
+                m = children.pop()
+                stack.append((x, children))
+                stack.append((m, None))
+            else:  # backtrack
+                on_path.discard(x.state)
+        thresholds.append((threshold, search.node_count - generated, expanded))
+        if verbose >= 2:
+            print('    generated {}, expanded {}\n'.format(thresholds[-1][1], thresholds[-1][2]))
+        if solution:
+            if verbose >= 1:
+                path = getpath(solution)
+                print('==> Path length {}, cost {}.'.format(len(path) - 1, solution.g),
+                      'Generated {}, {} iterations.'.format(search.node_count, len(thresholds)))
+                for (t, g, e) in thresholds:
+                    print('    threshold {:.2f}: generated {}, expanded {}'.format(t, g, e))
+            return finish(solution, search, 0, [], {}, 0, draw_edges)
+        threshold = next_threshold
+    if verbose >= 3: print("==> Couldn't find a solution.")
+    return False
+
+
+def ara_star(s0, next_states, goal_test, h, weight, verbose, draw_edges, search, solution_callback):
+    """
+    Anytime repairing A* (Likhachev, Gordon and Thrun, 2003). It does a series of
+    weighted A* searches, with the weight going from weight down to 1 in steps of 0.5 (or
+    faster, if the bound on the current solution is already smaller). Each search starts
+    from the g-values that the previous ones found, and only re-expands the states whose
+    g-values have improved since they were last expanded. The bounds it reports assume
+    that h is admissible.
+    """
+    (key_name, key_func, template) = sort_options['ara*']
+    unpack = search.unpack
+    if h is None:
+        h = lambda s: 0
+    search.track_children = False
+    root = Node(search.pack(s0), None, 0, h(s0), search)
+    best = {root.state: root}  # for each state, the node with the smallest g found so far
+    opened = [root]  # nodes to put into the frontier at the start of the next search
+    goal = None  # the goal node with the smallest g found so far
+    cost, bound = None, None  # cost and bound of the last solution we reported
+    w = weight
+    iterations = []  # for each search, (weight, nodes expanded, solution cost, bound)
+    while True:
+        frontier = Frontier(lambda y, w=w: y.g + w * y.h, opened)
+        key = frontier.key_func
+        closed = set()  # states expanded during this search
+        incons = {}  # states whose g-values improved after they were expanded
+        expanded = 0
+        if verbose >= 2:
+            print('==> ara* search with weight {:.2f}'.format(w))
+        if goal_test(s0):
+            goal = root
+        while frontier and (goal is None or key(goal) > key(frontier.top())):
+            x = frontier.pop()
+            closed.add(x.state)
+            expanded += 1
+            if verbose >= 3: print('{0:>5} Expand'.format(expanded), nodeinfo(x, template, unpack))
+            for (s, c) in next_states(unpack(x.state)):
+                p = search.pack(s)
+                old = best.get(p)
+                if old and old.g <= x.g + c:
+                    continue
+                m = Node(p, x, c, old.h if old else h(s), search)
+                best[p] = m
+                if goal_test(s) and (goal is None or m.g < goal.g):
+                    goal = m
+                if p in closed:
+                    incons[p] = m
+                else:
+                    if frontier.get(p):
+                        frontier.remove(frontier.get(p))
+                    frontier.add(m)
+            if draw_edges:
+                draw_edges(get_edges([x], unpack), 'expand')
+        if goal is None:
+            if verbose >= 3: print("==> Couldn't find a solution.")
+            return False
+
+        # Every state that might still lead to a cheaper solution is in the frontier or
+        # incons, so the smallest unweighted f-value among them is a lower bound on the
+        # optimal cost.
+        opened = list(frontier) + list(incons.values())
+        f_min = min([y.g + y.h for y in opened] + [goal.g])
+        new_bound = max(1.0, min(w, goal.g / f_min)) if f_min > 0 else 1.0
+        iterations.append((w, expanded, goal.g, new_bound))
+        if verbose >= 2:
+            print('    expanded {}, cost {}, bound {:.2f}\n'.format(expanded, goal.g, new_bound))
+        if cost is None or goal.g < cost or new_bound < bound:
+            (cost, bound) = (goal.g, new_bound)
+            if solution_callback:
+                solution_callback([unpack(y.state) for y in getpath(goal)], cost, bound)
+        if w <= 1 or bound <= 1:
+            break
+        w = max(1, min(w - 0.5, bound))
+
+    if verbose >= 1:
+        path = getpath(goal)
+        print('==> Path length {}, cost {}.'.format(len(path) - 1, goal.g),
+              'Generated {}, {} searches.'.format(search.node_count, len(iterations)))
+        for (w, e, c, b) in iterations:
+            print('    weight {:.2f}: expanded {}, cost {}, bound {:.2f}'.format(w, e, c, b))
+    return finish(goal, search, 0, [], {}, 0, draw_edges)
+
+
+def bidirectional(s0, goals, next_states, previous_states, verbose=2, draw_edges=None):
+    """
+    Bidirectional uniform-cost search. One search goes forward from s0, the other goes
+    backward from all of the goal states at once, and at each iteration we expand a node
+    from whichever frontier is smaller. Each time a generated state has also been reached
+    by the other search, we get a path through that state. The search stops when no
+    path can be cheaper than the best one found, i.e., when the smallest g-values in
+    the two frontiers add up to at least the cost of that path.
+    """
+    (key_name, key_func, template) = sort_options['uc']
+    search = Search(track_children=False)
+    forward = Node(s0, None, 0, 0, search)
+    # For each direction: the frontier, the explored states, and for each state the
+    # node with the smallest g-value found so far.
+    sides = {'forward': (Frontier(key_func, [forward]), {}, {s0: forward}, next_states),
+             'backward': (Frontier(key_func), {}, {}, previous_states)}
+    for s in goals:
+        sides['backward'][0].add(Node(s, None, 0, 0, search))
+        sides['backward'][2][s] = sides['backward'][0].get(s)
+    best_cost, meet = float('inf'), None  # cost of the best path so far, and its two halves
+    if s0 in sides['backward'][2]:
+        best_cost, meet = 0, (forward, sides['backward'][2][s0])
+    iteration = 0
+    while sides['forward'][0] and sides['backward'][0]:
+        if sides['forward'][0].top().g + sides['backward'][0].top().g >= best_cost:
+            break
+        iteration += 1
+        if len(sides['forward'][0]) <= len(sides['backward'][0]):
+            (direction, other) = ('forward', 'backward')
+        else:
+            (direction, other) = ('backward', 'forward')
+        (frontier, explored, best, successors) = sides[direction]
+        other_best = sides[other][2]
+        x = frontier.pop()
+        explored[x.state] = x
+        if verbose >= 2: print('{0:>3} Expand {1:>8}'.format(iteration, direction), nodeinfo(x, template))
+        new = []
+        for (s, cost) in successors(x.state):
+            if s in explored or (s in best and best[s].g <= x.g + cost):
+                continue
+            m = Node(s, x, cost, 0, search)
+            if frontier.get(s):
+                frontier.remove(frontier.get(s))
+            frontier.add(m)
+            best[s] = m
+            new.append(m)
+            if s in other_best and m.g + other_best[s].g < best_cost:
+                best_cost = m.g + other_best[s].g
+                meet = (m, other_best[s]) if direction == 'forward' else (other_best[s], m)
+        if draw_edges:
+            draw_edges(get_edges([x]), 'expand')
+            draw_edges(get_edges(new), 'add')
+    if meet is None:
+        if verbose >= 3: print("==> Couldn't find a solution.")
+        return False
+
+    # the forward half goes from s0 to the meeting state, and the backward half goes from
+    # the meeting state to a goal
+    path = getpath(meet[0]) + list(reversed(getpath(meet[1])))[1:]
+    if verbose >= 1:
+        print('==> Path length {}, cost {}.'.format(len(path) - 1, best_cost),
+              'Generated {}, explored {} forward and {} backward, frontier {}.'.format(
+                  search.node_count, len(sides['forward'][1]), len(sides['backward'][1]),
+                  len(sides['forward'][0]) + len(sides['backward'][0])))
+    if draw_edges:
+        draw_edges([(path[i].state[0], path[i + 1].state[0]) for i in range(len(path) - 1)],
+                   'solution')
+    return [y.state for y in path]
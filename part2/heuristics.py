@@ -14,6 +14,9 @@ This file contains three heuristic functions:
 
 import racetrack, math
 import sys  # to get readline
+import time, heapq, hashlib, os
+import numpy
+from collections import OrderedDict
 
 
 def h_edist(state, edge, walls):
@@ -50,6 +53,92 @@ g_fline = False
 g_walls = False
 grid = []
 
+# If edist_cache_dir is set to a directory, edist grids are saved there, one .npy file per
+# track, named by a hash of the finish line and walls (see track_fingerprint). Any process
+# that needs the grid for the same track can then load it from there instead of
+# recomputing it. It's off by default; a user cache directory such as
+# os.path.expanduser('~/.cache/racetrack') is a good place for it.
+edist_cache_dir = None
+
+# h_walldist keeps what it computes for a track in a
+# TrackContext. The contexts of recently used tracks are kept in track_contexts, least
+# recently used first, so that switching back and forth between tracks doesn't recompute
+# anything. When their estimated size goes over context_budget bytes, the least recently
+# used ones are thrown away. context_stats counts lookups that found a context (hits),
+# that had to create one (misses), and contexts thrown away (evictions).
+context_budget = 64 * 2 ** 20
+track_contexts = OrderedDict()
+context_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+last_context = None
+
+
+class TrackContext:
+    """
+    What the heuristics remember about one track: its edist grid, which is None until
+    h_walldist needs it, and a dict of state values for each heuristic that caches them.
+    """
+    __slots__ = ('key', 'fline', 'walls', 'grid', 'values')
+
+    def __init__(self, key, fline, walls):
+        self.key = key
+        self.fline = fline
+        self.walls = walls
+        self.grid = None
+        self.values = {}
+
+    def nbytes(self):
+        # rough estimate: a grid cell is a float plus a list slot, and a cached value is
+        # a dict entry plus the state's nested tuples
+        cells = len(self.grid) * len(self.grid[0]) if self.grid else 0
+        return 32 * cells + 250 * sum(len(d) for d in self.values.values())
+
+
+def track_context(fline, walls):
+    """
+    Return the TrackContext for the track with finish line fline and walls walls,
+    creating it if there isn't one. Consecutive calls with the same fline and walls
+    objects don't need to recompute the track's fingerprint.
+    """
+    global last_context
+    ctx = last_context
+    if ctx is not None and ctx.fline is fline and ctx.walls is walls:
+        context_stats['hits'] += 1
+        return ctx
+    key = track_fingerprint(fline, walls)
+    if key in track_contexts:
+        context_stats['hits'] += 1
+        ctx = track_contexts[key]
+        track_contexts.move_to_end(key)
+    else:
+        context_stats['misses'] += 1
+        ctx = TrackContext(key, fline, walls)
+        track_contexts[key] = ctx
+        trim_contexts()
+    ctx.fline, ctx.walls = fline, walls
+    last_context = ctx
+    return ctx
+
+
+def trim_contexts():
+    """
+    Throw away least recently used contexts until the rest fit in context_budget. The
+    most recently used context is always kept, even if it doesn't fit by itself.
+    """
+    total = sum(ctx.nbytes() for ctx in track_contexts.values())
+    while total > context_budget and len(track_contexts) > 1:
+        (key, ctx) = track_contexts.popitem(last=False)
+        total -= ctx.nbytes()
+        context_stats['evictions'] += 1
+
+
+def clear_track_contexts():
+    # forget all of the track contexts, and reset context_stats
+    global last_context
+    track_contexts.clear()
+    last_context = None
+    for k in context_stats:
+        context_stats[k] = 0
+
 
 def h_walldist(state, fline, walls):
     """
@@ -61,11 +150,12 @@ def h_walldist(state, fline, walls):
     On all subsequent calls, this function will retrieve the cached values and add an
     estimate of how long it will take to stop. 
     """
-    global g_fline, g_walls
-    if fline != g_fline or walls != g_walls or grid == []:
-        edist_grid(fline, walls)
+    ctx = track_context(fline, walls)
+    if ctx.grid is None:
+        ctx.grid = edist_grid(fline, walls)
+        trim_contexts()
     ((x, y), (u, v)) = state
-    hval = float(grid[x][y])
+    hval = float(ctx.grid[x][y])
 
     # add a small penalty to favor short stopping distances
     au = abs(u)
@@ -86,7 +176,58 @@ def h_walldist(state, fline, walls):
     return hval
 
 
-def edist_grid(fline, walls):
+def edist_grid(fline, walls, use_cache=True):
+    """
+    Compute a grid of approximate distances to the finish line that go around walls.
+    Each cell starts with its straight-line distance to the finish line (edistw_to_line),
+    and Dijkstra's algorithm spreads these values outward, one step (1 or sqrt 2) at a
+    time, so each cell is finalized once instead of being swept over repeatedly.
+    """
+    global grid, g_fline, g_walls, xmax, ymax
+    path = edist_cache_path(fline, walls) if use_cache else None
+    if path and os.path.exists(path):
+        grid = numpy.load(path).tolist()
+        xmax, ymax = len(grid) - 1, len(grid[0]) - 1
+        g_fline = fline
+        g_walls = walls
+        print('loaded edist grid from', path)
+        return grid
+    t = time.time()
+    xmax = max([max(x, x1) for ((x, y), (x1, y1)) in walls])
+    ymax = max([max(y, y1) for ((x, y), (x1, y1)) in walls])
+    grid = [[edistw_to_line((x, y), fline, walls) for y in range(ymax + 1)] for x in range(xmax + 1)]
+    print('computing edist grid', end=' ')
+    sys.stdout.flush()
+    queue = [(grid[x][y], x, y) for x in range(xmax + 1) for y in range(ymax + 1) if grid[x][y] != infinity]
+    heapq.heapify(queue)
+    relaxations = 0
+    while queue:
+        (d1, x1, y1) = heapq.heappop(queue)
+        if d1 > grid[x1][y1]:
+            continue        # (x1,y1) was already finalized with a smaller value
+        for x in range(max(0, x1 - 1), min(xmax + 1, x1 + 2)):
+            for y in range(max(0, y1 - 1), min(ymax + 1, y1 + 2)):
+                if x == x1 or y == y1:
+                    d = d1 + 1
+                else:
+                    d = d1 + 1.4142135623730951
+                relaxations += 1
+                if d < grid[x][y] and not racetrack.crash(((x, y), (x1, y1)), walls):
+                    grid[x][y] = d
+                    heapq.heappush(queue, (d, x, y))
+    print('done ({} relaxations, {:.2f} seconds)'.format(relaxations, time.time() - t))
+    g_fline = fline
+    g_walls = walls
+    if path:
+        save_edist_grid(path, grid)
+    return grid
+
+
+def edist_grid_sweeps(fline, walls):
+    """
+    The older version of edist_grid, which sweeps over the whole grid until nothing
+    changes. It gives the same grid as edist_grid (see check_edist_grid) but is much slower.
+    """
     global grid, g_fline, g_walls, xmax, ymax
     xmax = max([max(x, x1) for ((x, y), (x1, y1)) in walls])
     ymax = max([max(y, y1) for ((x, y), (x1, y1)) in walls])
@@ -116,6 +257,53 @@ def edist_grid(fline, walls):
     return grid
 
 
+def track_fingerprint(fline, walls):
+    """
+    Return a hash of the finish line and walls, which identifies the track's edist grid.
+    Tracks with the same finish line and walls in the same order get the same fingerprint,
+    whether the points are tuples or lists.
+    """
+    edges = [fline] + list(walls)
+    text = repr([(tuple(p1), tuple(p2)) for (p1, p2) in edges])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def edist_cache_path(fline, walls):
+    # where the track's grid is (or would be) saved, or None if there's no cache directory
+    if not edist_cache_dir:
+        return None
+    return os.path.join(edist_cache_dir, track_fingerprint(fline, walls) + '.npy')
+
+
+def save_edist_grid(path, grid):
+    """
+    Save grid as a .npy file at path. It's written to a temporary file first and then
+    renamed, so that another process never loads a partly written grid.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            numpy.save(f, numpy.array(grid, dtype=float))
+        os.replace(tmp, path)
+    except OSError as e:
+        print('could not save edist grid:', e)
+
+
+def check_edist_grid(problems):
+    """
+    Check that edist_grid and edist_grid_sweeps compute identical grids. problems is a
+    list of problems of the form (p0, fline, walls), such as the ones in sample_probs.
+    Return the number of problems on which they disagree.
+    """
+    disagree = 0
+    for (p0, fline, walls) in problems:
+        if edist_grid(fline, walls, use_cache=False) != edist_grid_sweeps(fline, walls):
+            disagree += 1
+    print('check_edist_grid: {} problems, {} disagreements'.format(len(problems), disagree))
+    return disagree
+
+
 def edistw_to_line(point, edge, walls):
     """
     straight-line distance from (x,y) to the line ((x1,y1),(x2,y2)).
@@ -2,9 +2,12 @@
 File: proj2.py -- Dana, April 24, 2018
 A simple-minded proj2 program. It uses racetrack.py to find a path to the goal
 ignoring the possibility of steering erros, and returns the first move in this path.
+The search is anytime repairing A* ('ara*'), so a move is written to choices.txt as
+soon as the first (weighted) solution is found, and a better one is written each
+time the search improves it. That way the supervisor gets a move even if it has to
+kill the search at time_limit.
 """
 
-import time
 import heuristics
 import racetrack   # program that runs fsearch
 import math
@@ -12,18 +15,20 @@ import math
 
 # Your proj2 function
 def main(state,finish,walls):
-    ((x,y), (u,v)) = state
     f = open('choices.txt', 'w')
-    path = racetrack.main(state,finish,walls,'gbf', heuristics.h_walldist, verbose=0, draw=0)
+
+    def write_choice(path, cost, bound):
+        """called by fsearch each time it finds a better path"""
+        if len(path) > 1:
+            velocity = path[1][1]
+        else:
+            velocity = (0,0)
+        print('  Proj2: cost {}, bound {:.2f}, new velocity {}'.format(cost, bound, velocity))
+        print(velocity,file=f,flush=True)
+
+    path = racetrack.main(state,finish,walls,'ara*', heuristics.h_walldist, verbose=0, draw=0,
+                          weight=3, solution_callback=write_choice)
     print('  Proj2: path =', path)
-    for i in range(len(path)):
-        print('  Proj2: path[',i,'] =', path[i])
-        if path[i] == state:
-            print('  Proj2: found state', state)
-            velocity = path[i+1][1]
-            print('  Proj2: new velocity', velocity)
-            break
-    print(velocity,file=f,flush=True)
 
 def initialize(state,fline,walls):
     print('Unfortunately, this work will be lost when the process exits.')
@@ -21,9 +21,10 @@ import math
 import time
 import shelve
 import random
+import heapq
 from itertools import product
 from heuristics import edist_grid
-from racetrack import crash  # program that runs fsearch
+from racetrack import crash, crash_mask, wall_array, WallIndex  # program that runs fsearch
 
 #
 # "edist" is the 2D array returned by heuristics.edist_grid(fline, walls). It contains for
@@ -37,91 +38,192 @@ from racetrack import crash  # program that runs fsearch
 #
 # expanded.keys() is a subset of values.keys()
 #
+# "predecessors" maps each child of an expanded state to a set of (parent, action) pairs,
+# one for each expanded parent and action that can produce the child. It is rebuilt from
+# "expanded" by initialize and kept up to date by add_predecessors, so that ancestors can
+# walk the policy graph backwards instead of searching it from every state in "policy".
+#
 # "crash_cost" if the cost of an action if it results in a crash. actions that don't result
 # in crashes have a cost of 1.
 #
-s0, fline, goals, walls, prob_size, crash_cost, edist, policy, values, expanded = (None for i in range(10))
+s0, fline, goals, walls, prob_size, crash_cost, edist, policy, values, expanded, predecessors = \
+    (None for i in range(11))
 
 policy_changed = False
 
+# policy_changes maps each state whose policy Bellman_update has changed, since main last
+# cleared it, to the children of the state's old policy action ({} if it had none).
+policy_changes = {}
+
+# If use_ilao is true, main uses ILAO* (see ILAO_iteration) instead of LAO*. If
+# use_predecessors is false, LAO_update uses ancestors_scan instead of ancestors, and if
+# use_priorities is false, it sweeps over all of the ancestors instead of doing prioritized
+# backups. lao_stats counts, since main started, the iterations of main's loop, the
+# expansions, the calls of ancestors (or ancestors_scan) and the time they took, and the
+# Bellman backups.
+use_ilao = False
+use_predecessors = True
+use_priorities = True
+lao_stats = {'iterations': 0, 'expansions': 0, 'ancestors calls': 0, 'ancestors seconds': 0.0,
+             'backups': 0}
 
-def main(s, f, w, time_limit=5):
+
+def main(s, f, w, time_limit=5, verbose=0):
     """
     :param s: the starting state
     :param f: the finish line
     :param w: the walls that cannot be crossed
     :param time_limit: the maximum search time
+    :param verbose: if nonzero, print lao_stats when the search finishes
     :return: the policy computed for state s
 
-    This function is am implementation of modified LAO* algorithm. Every time it computes
-    a better policy for state s, it prints the choice, followed by a linebreak, to a
-    file called choices.txt
+    This function is am implementation of modified LAO* algorithm, or of ILAO* if use_ilao
+    is true. Every time it computes a better policy for state s, it prints the choice,
+    followed by a linebreak, to a file called choices.txt
     """
 
     # Calculate, or upload from the cache file, each of "edist", "policy", "values",
     # "expanded". Using cache make this algorithm run much faster.
     initialize(s, f, w)
+    for key in lao_stats:
+        lao_stats[key] = 0
 
     # values stores the expected cost of getting to goal from every generated state
     if s not in values:    # initialize the value of state s
         values[s] = h_walldist(s)
 
-    # leaves_to_update contains every leaf of s that is neither a goal state nor a dead end
-    leaves_to_update = set(filter(lambda x: values[x] != math.inf, leaves(s) - goals))
-
     # action is the current policy for state s.
     action = policy[s] if s in policy else s[1]
     open("choices.txt", "w").write(str(action) + "\n")
     t = time.time()
+
+    if use_ilao:
+        # stop when an iteration expands nothing and no value changes much
+        while True:
+            (expansions, residual) = ILAO_iteration(s)
+            lao_stats['iterations'] += 1
+            action = report_choice(s, action)
+            if time.time() - t > 0.5:  # cache the data to disk periodically
+                t = time.time()
+                update_cache()
+            if expansions == 0 and residual < prob_size/100:
+                break
+        update_cache()
+        if verbose:
+            print_lao_stats()
+        return action
+
+    # solution contains every state in the best solution graph of s, i.e., every state
+    # that is reachable from s under the current policy. leaves_to_update contains every
+    # leaf of the solution graph that is neither a goal state nor a dead end. Both are
+    # updated incrementally after each LAO update (see update_solution).
+    solution = set()
+    leaves_to_update = Fringe(x for x in leaves(s, solution) if is_fringe(x))
+
     while leaves_to_update:    # has not found a safe policy
-        state = random.choice(tuple(leaves_to_update))
+        lao_stats['iterations'] += 1
+        state = leaves_to_update.choice()
         if state not in expanded:
-            # state not in "expanded" means LAO* has never been called on this leaf state
-            # before. Since this is the first time LAO* update is called on this state, we
-            # need to add it to "expanded".
-            #
-            # applicable(state) returns a map that maps each of the applicable actions
-            # to the possible states that may result from taking that action. Therefore,
-            # "expanded" is actually a map of maps.
-            #
-            # Below is a sketch for a key:value pair in "expanded"
-            #
-            #            {action1 : possible next states,
-            #   state :   action2 : possible next states,
-            #             action3 : possible next states}
-            #
-            expanded[state] = applicable(state)
-
-            # At this points some of its children may have been generated and added to
-            # "values", but some may have not. We need to make sure every one of its
-            # children is added to "values" before we perform the LAO update.
-            for move in expanded[state]:
-                for child in expanded[state][move]:
-                    if child not in values:
-                        values[child] = h_walldist(child)
+            expand(state)
 
         # perform the LAO update. The update returns when the leaves of the state change
         # or no more progress can be made.
+        policy_changes.clear()
         LAO_update(state)
 
-        # if the policy for state s has changed, print it to "choices.txt"
-        if s in policy and action != policy[s]:
-            action = policy[s]
-            file = open("choices.txt", "a")
-            file.write(str(action) + "\n")
-            file.close()
+        action = report_choice(s, action)
 
         if time.time() - t > 0.5:  # cache the data to disk periodically
             t = time.time()
             update_cache()
 
-        # recalculate the leaves to update
-        leaves_to_update = set(filter(lambda x: values[x] != math.inf, leaves(s) - goals))
+        # update the leaves to update
+        update_solution(s, state, solution, leaves_to_update)
 
     update_cache()  # cache the data to disk when finish.
+    if verbose:
+        print_lao_stats()
+    return action
+
+
+def print_lao_stats():
+    print('{} iterations, {} expansions, {} backups, {} ancestors calls ({:.2f} seconds)'.format(
+        lao_stats['iterations'], lao_stats['expansions'], lao_stats['backups'],
+        lao_stats['ancestors calls'], lao_stats['ancestors seconds']))
+
+
+def report_choice(s, action):
+    """
+    If the policy for state s is no longer action, print it to "choices.txt". Return the
+    policy for s.
+    """
+    if s in policy and action != policy[s]:
+        action = policy[s]
+        file = open("choices.txt", "a")
+        file.write(str(action) + "\n")
+        file.close()
     return action
 
 
+def expand(state):
+    """Add state to "expanded", and add each of its children to "values"."""
+    # state not in "expanded" means LAO* has never been called on this leaf state
+    # before. Since this is the first time LAO* update is called on this state, we
+    # need to add it to "expanded".
+    #
+    # applicable(state) returns a map that maps each of the applicable actions
+    # to the possible states that may result from taking that action. Therefore,
+    # "expanded" is actually a map of maps.
+    #
+    # Below is a sketch for a key:value pair in "expanded"
+    #
+    #            {action1 : possible next states,
+    #   state :   action2 : possible next states,
+    #             action3 : possible next states}
+    #
+    expanded[state] = applicable(state)
+    add_predecessors(state)
+
+    # At this points some of its children may have been generated and added to
+    # "values", but some may have not. We need to make sure every one of its
+    # children is added to "values" before we perform the LAO update.
+    for move in expanded[state]:
+        for child in expanded[state][move]:
+            if child not in values:
+                values[child] = h_walldist(child)
+    lao_stats['expansions'] += 1
+
+
+def ILAO_iteration(s):
+    """
+    One iteration of ILAO*: a depth-first search of the best solution graph of s that
+    expands every leaf it gets to that is neither a goal state nor a dead end, and does a
+    Bellman update of every non-goal state in postorder, so that each state is updated
+    after its children. Return the number of expansions and the largest change of a value.
+    """
+    expansions = 0
+    residual = 0
+    explored = {s}
+    stack = [(s, False)]
+    while stack:
+        (state, children_done) = stack.pop()
+        if children_done:
+            residual = max(residual, Bellman_update(state))
+            continue
+        if state in goals:
+            continue
+        if is_fringe(state) and state not in expanded:
+            expand(state)
+            expansions += 1
+        stack.append((state, True))
+        if state in policy:
+            for child in expanded[state][policy[state]]:
+                if child not in explored:
+                    explored.add(child)
+                    stack.append((child, False))
+    return (expansions, residual)
+
+
 def LAO_update(s):
     """
     This function performs value updates on s and all of its policy-ancestors, until the
@@ -130,13 +232,20 @@ def LAO_update(s):
     global policy_changed, prob_size
 
     # Z contains s and all policy-ancestors of s.
-    Z = ancestors(s)
+    t = time.time()
+    Z = ancestors(s) if use_predecessors else ancestors_scan(s)
+    lao_stats['ancestors calls'] += 1
+    lao_stats['ancestors seconds'] += time.time() - t
 
     # set the initial best move at s. This update may change the policy for s, so
     # reset policy_changed to false.
-    Bellman_update(s)
+    r = Bellman_update(s)
     policy_changed = False
 
+    if use_priorities:
+        prioritized_backups(s, r, Z)
+        return
+
     while not policy_changed:
         # The loop stops if the policy changed or no much more progress can be made
         # The book says the loop should stop when the leaves of s0 changed. But since it's
@@ -147,13 +256,50 @@ def LAO_update(s):
         if r < prob_size/100: break
 
 
+def prioritized_backups(s, r, Z):
+    """
+    Prioritized sweeping: instead of updating all of Z over and over, keep a priority queue
+    of the states in Z whose values may be out of date. When a state's value changes by r,
+    each of its predecessors in Z is queued with priority r times the probability of
+    getting to the state from it, and the state with the highest priority is updated next.
+    A change of less than prob_size/100 isn't passed on. When the queue is empty, or the
+    policy changes, all of Z is updated once, as in a sweep, and the states that still
+    changed by prob_size/100 or more are passed on. Like the sweeps, the backups stop when
+    a sweep changes nothing by that much, or when the policy changes.
+    """
+    queue = []       # heap of (-priority, state)
+    priority = {}    # the priority of each state in queue
+    changed = [(s, r)]
+    while changed:
+        while changed:
+            (child, r) = changed.pop()
+            for (parent, action) in predecessors.get(child, ()):
+                p = r * expanded[parent].get(action, {}).get(child, 0)
+                if parent in Z and p > priority.get(parent, 0):
+                    priority[parent] = p
+                    heapq.heappush(queue, (-p, parent))
+            while queue and not changed and not policy_changed:
+                (p, state) = heapq.heappop(queue)
+                if priority.get(state) == -p:
+                    del priority[state]
+                    r = Bellman_update(state)
+                    if r >= prob_size/100:
+                        changed.append((state, r))
+        states = list(Z)
+        residuals = list(map(Bellman_update, states))
+        if policy_changed: break
+        changed = [(state, r) for (state, r) in zip(states, residuals) if r >= prob_size/100]
+
+
 def Bellman_update(s):
     """
     :param s: the state to be updated
     :return: the absolute change of the value of s due to the update.
     """
     if values[s] == math.inf: return 0   # if s is a dead end, it cannot be updated.
+    lao_stats['backups'] += 1
     policy_old = policy.get(s, None)    # the policy for s before the update
+    children_old = expanded[s].get(policy_old, {})
     value_old = values[s]         # the value of s before the update
     costs_to_go = {}     # will map every applicable action to the action's cost-to-go
 
@@ -186,14 +332,38 @@ def Bellman_update(s):
     if policy_old != policy.get(s, None):
         global policy_changed
         policy_changed = True
+        policy_changes.setdefault(s, children_old)
 
     return abs(values[s] - value_old)
 
 
 def ancestors(s):
     """
-    This method iterates through all of the states in "policy" and return those who have state s
-    as one of their descendants.
+    Return the set of states that have s as one of their descendants under the current
+    policy, by following "predecessors" backwards along the policy's edges. The returned
+    set contains s itself.
+    """
+    result = {s}
+    stack = [s]
+    while stack:
+        for (parent, action) in predecessors.get(stack.pop(), ()):
+            if parent not in result and policy.get(parent) == action:
+                result.add(parent)
+                stack.append(parent)
+    return result
+
+
+def add_predecessors(s):
+    """Record s as a predecessor of each of its children in "expanded"."""
+    for action in expanded[s]:
+        for child in expanded[s][action]:
+            predecessors.setdefault(child, set()).add((s, action))
+
+
+def ancestors_scan(s):
+    """
+    The old version of ancestors, for comparison. This method iterates through all of the
+    states in "policy" and return those who have state s as one of their descendants.
     The returned set contains s itself.
     """
     ancestors = {s}
@@ -203,28 +373,116 @@ def ancestors(s):
     return ancestors
 
 
-def leaves(s, explored=None):
+def leaves(s, graph=None):
     """
     :param s: The state of which we want to collect the leaves.
-    :param explored: The states whose leaves have been collected. This parameter helps the method
-              to avoid checking the same state multiple times.
+    :param graph: If this is a set, every state that is reachable from s under the current
+              policy, leaves and non-leaves alike, is added to it.
     :return: The leaves of s under the current policy.
-    """
-    if explored is None:
-        explored = {s}
-    else:
-        explored.add(s)
-
-    if s not in policy:
-        return {s}
 
+    The policy graph is walked with an explicit stack rather than recursively, since on
+    long tracks it can be deeper than Python's recursion limit.
+    """
+    explored = {s} if graph is None else graph
+    explored.add(s)
+    stack = [s]
     leaf_states = set()
-    for child in expanded[s][policy[s]]:
-        if child not in explored:
-            leaf_states |= leaves(child, explored)
+    while stack:
+        state = stack.pop()
+        if state not in policy:
+            leaf_states.add(state)
+            continue
+        for child in expanded[state][policy[state]]:
+            if child not in explored:
+                explored.add(child)
+                stack.append(child)
     return leaf_states
 
 
+def is_fringe(s):
+    """Test whether s is a leaf of the policy graph that is neither a goal nor a dead end."""
+    return s not in policy and s not in goals and values[s] != math.inf
+
+
+def update_solution(s, state, solution, fringe):
+    """
+    Update solution, the best solution graph of s, and fringe, its leaves to update,
+    after an LAO update of state. Only the states beneath the states in policy_changes
+    are looked at: those that were beneath an old policy action are suspects, which
+    stay in the graph only if a new policy edge leads to them from a state that is
+    still in it. predecessors tells us which edges lead to a suspect.
+    """
+    suspects = set()
+    stack = [child for old in policy_changes.values() for child in old]
+    while stack:
+        x = stack.pop()
+        if x in solution and x not in suspects and x != s:
+            suspects.add(x)
+            if x in policy:
+                stack.extend(expanded[x][policy[x]])
+
+    # whatever can be reached from the states that are surely still in the graph
+    stack = [x for x in suspects for (parent, action) in predecessors.get(x, ())
+             if parent in solution and parent not in suspects and policy.get(parent) == action]
+    stack += [child for x in policy_changes if x in solution and x not in suspects and x in policy
+              for child in expanded[x][policy[x]]]
+    added = set()
+    while stack:
+        x = stack.pop()
+        if x in added or (x in solution and x not in suspects):
+            continue
+        added.add(x)
+        suspects.discard(x)
+        if x in policy:
+            stack.extend(expanded[x][policy[x]])
+
+    for x in suspects:
+        solution.discard(x)
+        fringe.discard(x)
+    solution |= added
+    for x in added.union(policy_changes, [state]):
+        if x in solution and is_fringe(x):
+            fringe.add(x)
+        else:
+            fringe.discard(x)
+
+
+class Fringe:
+    """
+    A set of states that can also choose a random state in constant time. The states are
+    kept in a list, and index maps each of them to its position in the list.
+    """
+
+    def __init__(self, states=()):
+        self.states = []
+        self.index = {}
+        for x in states:
+            self.add(x)
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, x):
+        return x in self.index
+
+    def add(self, x):
+        if x not in self.index:
+            self.index[x] = len(self.states)
+            self.states.append(x)
+
+    def discard(self, x):
+        # move the last state into x's place
+        i = self.index.pop(x, None)
+        if i is not None:
+            last = self.states.pop()
+            if i < len(self.states):
+                self.states[i] = last
+                self.index[last] = i
+
+    def choice(self):
+        return random.choice(self.states)
+
+
 def applicable(s):
     """
     This function finds the applicable actions at s and associates with each of them the
@@ -234,30 +492,22 @@ def applicable(s):
     actions = {(s[1][0] + u, s[1][1] + v) for u in [-1, 0, 1] for v in [-1, 0, 1]}
     if ((0, 0) in actions) and ((s[0], (0, 0)) not in goals):
         actions.remove((0, 0))
-    usable = {}
+    # collect every possible outcome of every action, and crash-test them all in one pass
+    outcomes = []
     for action in actions:
-        child_states = children(s, action)
-        if child_states:
-            usable[action] = child_states
+        q = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[0]) > 1]
+        r = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[1]) > 1]
+        for e in [(e1, e2) for e1 in q for e2 in r]:
+            p = tuple(map(sum, zip(s[0], action, e)))
+            outcomes.append((action, p, q[e[0]] * r[e[1]]))
+    crashes = crash_mask([(s[0], p) for (action, p, prob) in outcomes], wall_array(walls))
+    usable = {}
+    for ((action, p, prob), crashed) in zip(outcomes, crashes):
+        if not crashed:
+            usable.setdefault(action, {})[(p, action)] = prob
     return usable
 
 
-def children(s, action):
-    """
-    This function computes all of the possible child states that may be resulted from
-    taking the action at state s, and it maps each of the possible child states with a
-    possibility that depends on the velocity of the action.
-    """
-    child_states = {}
-    q = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[0]) > 1]
-    r = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[1]) > 1]
-    for e in [(e1, e2) for e1 in q for e2 in r]:
-        p = tuple(map(sum, zip(s[0], action, e)))
-        if not crash((s[0], p), walls):
-            child_states[(p, action)] = q[e[0]] * r[e[1]]
-    return child_states
-
-
 def is_dead_move(s, action):
     # Check if the action at s has no hope to result in a lawful state.
     for child in expanded[s][action]:
@@ -313,8 +563,8 @@ def initialize(s, f, w):
 
     Meanwhile, set the cost of crash to be 5 times the problem size
     """
-    global s0, fline, goals, walls, prob_size, crash_cost, edist, policy, values, expanded
-    s0, fline, walls = s, f, w
+    global s0, fline, goals, walls, prob_size, crash_cost, edist, policy, values, expanded, predecessors
+    s0, fline, walls = s, f, WallIndex(w)
     goals = goal_states(f)
     prob_size = max({p[0][0] for p in walls})
     crash_cost = prob_size * 5
@@ -334,6 +584,10 @@ def initialize(s, f, w):
     expanded = data_cache["expanded"]
     data_cache.close()
 
+    predecessors = {}
+    for state in expanded:
+        add_predecessors(state)
+
 
 def update_cache():
     # update the cached data.
@@ -26,7 +26,7 @@ import random
 from numpy import random as rand
 from itertools import product
 from heuristics import edist_grid
-from racetrack import crash
+from racetrack import crash, crash_mask, wall_array, WallIndex
 
 #
 # "edist" is the 2D array returned by heuristics.edist_grid(fline, walls). It contains for
@@ -236,12 +236,7 @@ def applicable(s):
         else:
             actions.remove((0, 0))
 
-    usable = {}
-    for action in actions:
-        child_states = children(s, action)
-        if child_states:
-            usable[action] = child_states
-    return usable
+    return outcomes(s, actions)
 
 
 def is_dead_move(s, action):
@@ -263,14 +258,28 @@ def children(s, action):
     taking the action at state s, and it maps each of the possible child states with a
     possibility that depends on the velocity of the action.
     """
-    child_states = {}
-    q = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[0]) > 1]
-    r = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[1]) > 1]
-    for e in [(e1, e2) for e1 in q for e2 in r]:
-        p = tuple(map(sum, zip(s[0], action, e)))
-        if not crash((s[0], p), walls):
-            child_states[(p, action)] = q[e[0]] * r[e[1]]
-    return child_states
+    return outcomes(s, [action]).get(action, {})
+
+
+def outcomes(s, actions):
+    """
+    Map each of the actions at state s to its possible child states (see children), leaving
+    out the actions whose every outcome crashes. The outcomes of all of the actions are
+    crash-tested in one pass.
+    """
+    results = []
+    for action in actions:
+        q = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[0]) > 1]
+        r = ({0:1}, {-1:0.2, 0:0.6, 1:0.2})[abs(action[1]) > 1]
+        for e in [(e1, e2) for e1 in q for e2 in r]:
+            p = tuple(map(sum, zip(s[0], action, e)))
+            results.append((action, p, q[e[0]] * r[e[1]]))
+    crashes = crash_mask([(s[0], p) for (action, p, prob) in results], wall_array(walls))
+    usable = {}
+    for ((action, p, prob), crashed) in zip(results, crashes):
+        if not crashed:
+            usable.setdefault(action, {})[(p, action)] = prob
+    return usable
 
 
 def goal_states(f):
@@ -334,7 +343,7 @@ def initialize(s, f, w):
     and the maximum depth bound to be one fourth of the problem size.
     """
     global fline, goals, walls, edist, h_max, crash_cost, envelope
-    fline, walls,  = f, w
+    fline, walls = f, WallIndex(w)
     goals = goal_states(f)
     crash_cost, h_max = 100, 5
 
@@ -6,19 +6,20 @@ This is like racetrack.py in Project 1, but its arguments are modified so that i
 can be invoked on a current state that has a nonzero velocity
 """
 
-import sys              # We need sys.readline
-import tdraw, turtle    # Code to use Python's "turtle drawing" package
-import math
+import tdraw, turtle  # Code to use Python's "turtle drawing" package
 import fsearch
-import math             # one of the heuristic functions takes the square root
+import numpy
 
 
-def main(s, f_line, walls, strategy, h, verbose=2, draw=0, title=''):
+def main(s, f_line, walls, strategy, h, verbose=2, draw=0, title='', compact=0, cache_moves=0,
+         weight=2, solution_callback=None):
     """
     Args are as follows:
     - s is the initial state, f_line is the finish line, walls is a list of walls
     - strategy should be 'bf' (best first), 'df' (depth first),
-        'uc' (uniform cost), 'gbf' (greedy best first), 'a*', or
+        'uc' (uniform cost), 'gbf' (greedy best first), 'a*', 'ida*' (iterative-deepening A*),
+        'wa*' (weighted A*), 'ara*' (anytime repairing A*), 'bidir' (bidirectional
+        uniform-cost search, which doesn't use h), or
         'none' (don't try to solve the problem, just display it).
     - h should be a heuristic function of three arguments h(s,f_line,walls), where
         s is the current state, f_line is the finish line, walls is a list of walls
@@ -31,24 +32,46 @@ def main(s, f_line, walls, strategy, h, verbose=2, draw=0, title=''):
     - draw should either be 0 (draw nothing) or 1 (draw everything)
     - title is a title to put at the top of the drawing. It defaults to the names of the
         search strategy and heuristic (if there is one)
+    - compact should either be 0 (fsearch keeps the whole search tree) or 1 (fsearch
+        keeps only parent pointers, and stores each state packed into an int)
+    - cache_moves should either be 0 (test every move against the walls) or 1 (look
+        moves up in the MoveTable for the walls, which is shared by all searches on
+        the same track)
+    - weight and solution_callback are passed on to fsearch.main, for 'wa*' and 'ara*'
     """
+    walls = WallIndex(walls)  # a tuple of walls, indexed to make crash faster
+
     # convert h, next_states, and goal_test to the one-arg functions fsearch wants
+    table = move_table(walls) if cache_moves else None
     h_for_fsearch = lambda state: h(state, f_line, walls)
-    next_for_fsearch = lambda state: [(ns,1) for ns in next_states(state,walls)]
-    goal_for_fsearch = lambda state: goal_test(state,f_line)
+    next_for_fsearch = lambda state: [(s1, 1) for s1 in next_states(state, walls, table)]
+    goal_for_fsearch = lambda state: goal_test(state, f_line)
 
     if draw:
         draw_edges = tdraw.draw_edges
-        if title == '': 
-            if h:  title = strategy + ', ' + h.__name__
-            else:  title = strategy
-        turtle.Screen()             # open the graphics window
+        if title == '':
+            if h:
+                title = strategy + ', ' + h.__name__
+            else:
+                title = strategy
+        turtle.Screen()  # open the graphics window
         tdraw.draw_problem((s[0], f_line, walls), title=title)
     else:
         draw_edges = None
-    if strategy != 'none':
-        solution = fsearch.main(s, next_for_fsearch, goal_for_fsearch, strategy, \
-        h_for_fsearch, verbose, draw_edges)
+    if strategy == 'bidir':
+        prev_for_fsearch = lambda state: [(s1, 1) for s1 in previous_states(state, walls, table)]
+        solution = fsearch.bidirectional(s, goal_states(f_line), next_for_fsearch,
+                                         prev_for_fsearch, verbose, draw_edges)
+    elif strategy != 'none':
+        if compact:
+            solution = fsearch.main(s, next_for_fsearch, goal_for_fsearch, strategy, h_for_fsearch,
+                                    verbose, draw_edges, track_children=False,
+                                    pack=pack_state, unpack=unpack_state, weight=weight,
+                                    solution_callback=solution_callback)
+        else:
+            solution = fsearch.main(s, next_for_fsearch, goal_for_fsearch, strategy, h_for_fsearch,
+                                    verbose, draw_edges, weight=weight,
+                                    solution_callback=solution_callback)
     else:
         solution = None
     if draw:
@@ -61,31 +84,277 @@ def main(s, f_line, walls, strategy, h, verbose=2, draw=0, title=''):
 ####  Domain-Specific Functions for the Racetrack game ####
 ###########################################################
 
-def next_states(state,walls):
-    """Return a list of states we can go to from state"""
+
+def next_states(state, walls, table=None):
+    """
+    Return a list of states we can go to from state. If table is a MoveTable for walls,
+    use it instead of testing each move against the walls.
+    """
     states = []
-    (loc,(vx,vy)) = state
-    for dx in [0,-1,1]:
-        for dy in [0,-1,1]:
-            (wx,wy) = (vx+dx,vy+dy)
-            newloc = (loc[0]+wx,loc[1]+wy)
-            if not crash((loc,newloc),walls):
-                states.append((newloc,(wx,wy)))
+    (loc, (vx, vy)) = state
+    for dx in [0, -1, 1]:
+        for dy in [0, -1, 1]:
+            (wx, wy) = (vx + dx, vy + dy)
+            newloc = (loc[0] + wx, loc[1] + wy)
+            if table:
+                crashed = table.crash(loc, newloc)
+            else:
+                crashed = crash((loc, newloc), walls)
+            if not crashed:
+                states.append((newloc, (wx, wy)))
     return states
 
-def goal_test(state,f_line):
+
+def previous_states(state, walls, table=None):
+    """
+    Return a list of states from which we can go to state, i.e., the inverse of
+    next_states. To arrive at (loc,(wx,wy)), the previous location must have been
+    loc - (wx,wy), and the previous velocity must have been (wx-dx, wy-dy) for one
+    of the 9 accelerations (dx,dy). All 9 of them use the same move. If table is a
+    MoveTable for walls, use it instead of testing the move against the walls.
+    """
+    (newloc, (wx, wy)) = state
+    loc = (newloc[0] - wx, newloc[1] - wy)
+    if loc[0] < 0 or loc[1] < 0:
+        return []
+    if table.crash(loc, newloc) if table else crash((loc, newloc), walls):
+        return []
+    return [(loc, (wx - dx, wy - dy)) for dx in [0, -1, 1] for dy in [0, -1, 1]]
+
+
+def goal_states(f_line):
+    """Return a list of all the states that satisfy goal_test"""
+    ((x1, y1), (x2, y2)) = f_line
+    points = [(x, y) for x in range(min(x1, x2), max(x1, x2) + 1)
+              for y in range(min(y1, y2), max(y1, y2) + 1)]
+    return [(p, (0, 0)) for p in points if intersect((p, p), f_line)]
+
+
+def goal_test(state, f_line):
     """Test whether state is on the finish line and has velocity (0,0)"""
-    return state[1] == (0,0) and intersect((state[0],state[0]), f_line)
+    return state[1] == (0, 0) and intersect((state[0], state[0]), f_line)
+
+
+def pack_state(state):
+    """
+    Pack a state ((x,y), (u,v)) into a single int, 16 bits per number. This assumes
+    0 <= x,y < 65536 and -32768 <= u,v < 32768, which holds for any reasonable track.
+    """
+    ((x, y), (u, v)) = state
+    return x | (y << 16) | ((u + 32768) << 32) | ((v + 32768) << 48)
+
+
+def unpack_state(n):
+    """Inverse of pack_state"""
+    return ((n & 0xffff, (n >> 16) & 0xffff), (((n >> 32) & 0xffff) - 32768, (n >> 48) - 32768))
+
+
+class MoveTable:
+    """
+    A cache of crash tests for one list of walls. table.crash(loc, newloc) returns the
+    same thing as crash((loc, newloc), walls), but each (loc, displacement) pair only
+    gets tested against the walls once. The table keeps its own copy of the walls, so
+    changing the caller's list afterwards won't make the table give wrong answers; use
+    move_table to get the table for the current walls.
+    """
+
+    def __init__(self, walls):
+        self.walls = [(tuple(a), tuple(b)) for (a, b) in walls]
+        self.table = {}  # maps (x, y, dx, dy) to True (crash) or False
+        self.hits = 0
+        self.misses = 0
+
+    def crash(self, loc, newloc):
+        key = (loc[0], loc[1], newloc[0] - loc[0], newloc[1] - loc[1])
+        crashed = self.table.get(key)
+        if crashed is None:
+            self.misses += 1
+            crashed = self.table[key] = crash((loc, newloc), self.walls)
+        else:
+            self.hits += 1
+        return crashed
+
+    def build(self, max_speed):
+        """
+        Fill in the table for every gridpoint inside the walls' bounding box and every
+        displacement (dx,dy) with |dx|, |dy| <= max_speed.
+        """
+        xmax = max([max(a[0], b[0]) for (a, b) in self.walls])
+        ymax = max([max(a[1], b[1]) for (a, b) in self.walls])
+        for x in range(xmax + 1):
+            for y in range(ymax + 1):
+                for dx in range(-max_speed, max_speed + 1):
+                    for dy in range(-max_speed, max_speed + 1):
+                        self.crash((x, y), (x + dx, y + dy))
+
+
+# MoveTables for the tracks we've seen, keyed by the walls
+move_tables = {}
+
+
+def move_table(walls):
+    """
+    Return the MoveTable for walls, creating it if necessary. Since the tables are keyed
+    by the contents of walls, a list of walls that has changed gets a new table.
+    """
+    key = tuple((tuple(a), tuple(b)) for (a, b) in walls)
+    if key not in move_tables:
+        move_tables[key] = MoveTable(walls)
+    return move_tables[key]
+
+
+def clear_move_tables():
+    move_tables.clear()
+
+
+class WallIndex(tuple):
+    """
+    A tuple of walls, plus a uniform grid of square cells. Each cell has a list of the
+    walls whose bounding boxes overlap it, so crash only needs to test a move against
+    the walls in the cells that the move's bounding box overlaps. Since it's a tuple,
+    a WallIndex can be used anywhere a list of walls can.
+    """
+
+    def __new__(cls, walls, cell=4):
+        self = tuple.__new__(cls, [(tuple(a), tuple(b)) for (a, b) in walls])
+        self.cell = cell
+        self.nx = int(max([max(a[0], b[0]) for (a, b) in self] + [0]) // cell) + 1
+        self.ny = int(max([max(a[1], b[1]) for (a, b) in self] + [0]) // cell) + 1
+        self.cells = [[[] for j in range(self.ny)] for i in range(self.nx)]
+        for wall in self:
+            (i0, i1, j0, j1) = self.cell_range(wall)
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    self.cells[i][j].append(wall)
+        return self
+
+    def cell_range(self, edge):
+        """
+        Return (i0, i1, j0, j1) such that cells[i][j] for i0 <= i <= i1, j0 <= j <= j1
+        cover the part of edge's bounding box that's inside the grid
+        """
+        ((xa, ya), (xb, yb)) = edge
+        c = self.cell
+        i0 = min(max(int(min(xa, xb) // c), 0), self.nx - 1)
+        i1 = min(max(int(max(xa, xb) // c), 0), self.nx - 1)
+        j0 = min(max(int(min(ya, yb) // c), 0), self.ny - 1)
+        j1 = min(max(int(max(ya, yb) // c), 0), self.ny - 1)
+        return (i0, i1, j0, j1)
+
+    def near(self, move):
+        """Return a list of the walls that move might intersect"""
+        (i0, i1, j0, j1) = self.cell_range(move)
+        if i0 == i1 and j0 == j1:
+            return self.cells[i0][j0]
+        # a wall can be in several cells; dict.fromkeys removes the duplicates
+        return dict.fromkeys(w for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)
+                             for w in self.cells[i][j])
 
-def crash(move,walls):
-    """Test whether move intersects a wall in walls"""
+
+def crash(move, walls):
+    """
+    Test whether move intersects a wall in walls. If walls is a WallIndex, only the
+    walls near move are tested.
+    """
+    if isinstance(walls, WallIndex):
+        walls = walls.near(move)
     for wall in walls:
-        if intersect(move,wall): return True
+        if intersect(move, wall): return True
+    return False
+
+
+def wall_array(walls):
+    """
+    Return walls as a numpy array of shape (W,2,2), for use with crash_mask. If walls
+    is a WallIndex, the array is computed once and kept in it.
+    """
+    if isinstance(walls, WallIndex):
+        if 'array' not in walls.__dict__:
+            walls.array = numpy.array(walls, dtype=float).reshape(-1, 2, 2)
+        return walls.array
+    return numpy.array(walls, dtype=float).reshape(-1, 2, 2)
+
+
+def crash_mask(moves, walls):
+    """
+    Vectorized version of crash, for testing a lot of moves at once. moves should have
+    shape (N,2,2) (a list of N moves is OK), and walls should be a wall_array. Return a
+    numpy array of N booleans, telling which moves intersect a wall. The test is the
+    same one that intersect does, done on all N x W pairs of moves and walls at once.
+    """
+    moves = numpy.asarray(moves, dtype=float).reshape(-1, 2, 2)
+    if len(moves) == 0 or len(walls) == 0:
+        return numpy.zeros(len(moves), dtype=bool)
+    # coordinates, shaped so that they broadcast to (N,W)
+    (x1a, y1a, x1b, y1b) = (moves[:, None, i, j] for i in (0, 1) for j in (0, 1))
+    (x2a, y2a, x2b, y2b) = (walls[None, :, i, j] for i in (0, 1) for j in (0, 1))
+    dx1 = x1b - x1a
+    dy1 = y1b - y1a
+    dx2 = x2b - x2a
+    dy2 = y2b - y2a
+    d1a = dx2 * (y1a - y2a) - dy2 * (x1a - x2a)
+    d1b = dx2 * (y1b - y2a) - dy2 * (x1b - x2a)
+    d2a = dx1 * (y2a - y1a) - dy1 * (x2a - x1a)
+    d2b = dx1 * (y2b - y1a) - dy1 * (x2b - x1a)
+
+    def between(a, b, c):
+        return ((a <= c) & (c <= b)) | ((b <= c) & (c <= a))
+
+    hits = (d1a * d1b < 0) & (d2a * d2b < 0)
+    hits |= (d1a == 0) & between(x2a, x2b, x1a) & between(y2a, y2b, y1a)
+    hits |= (d1b == 0) & between(x2a, x2b, x1b) & between(y2a, y2b, y1b)
+    hits |= (d2a == 0) & between(x1a, x1b, x2a) & between(y1a, y1b, y2a)
+    hits |= (d2b == 0) & between(x1a, x1b, x2b) & between(y1a, y1b, y2b)
+    return hits.any(axis=1)
+
+
+def intersect(e1, e2):
+    """
+    Test whether edges e1 and e2 intersect. This uses the signs of cross products
+    (orientation tests) rather than slopes, so it never divides. With integer coordinates
+    the arithmetic is exact, and it doesn't allocate any tuples. intersect_by_slopes is
+    the older version, which gives the same answers (see check_intersect).
+    """
+    ((x1a, y1a), (x1b, y1b)) = e1
+    ((x2a, y2a), (x2b, y2b)) = e2
+    dx1 = x1b - x1a
+    dy1 = y1b - y1a
+    dx2 = x2b - x2a
+    dy2 = y2b - y2a
+
+    # which side of e2's line each endpoint of e1 is on, and vice versa
+    # (positive = left, negative = right, zero = on the line)
+    d1a = dx2 * (y1a - y2a) - dy2 * (x1a - x2a)
+    d1b = dx2 * (y1b - y2a) - dy2 * (x1b - x2a)
+    d2a = dx1 * (y2a - y1a) - dy1 * (x2a - x1a)
+    d2b = dx1 * (y2b - y1a) - dy1 * (x2b - x1a)
+
+    # proper crossing: each edge has its endpoints strictly on opposite sides of the other
+    if ((d1a > 0 > d1b) or (d1a < 0 < d1b)) and ((d2a > 0 > d2b) or (d2a < 0 < d2b)):
+        return True
+
+    # Otherwise they intersect only if an endpoint of one edge is on the other edge.
+    # A point on an edge's line is on the edge if it's inside the edge's bounding box.
+    if d1a == 0 and (x2a <= x1a <= x2b or x2b <= x1a <= x2a) \
+            and (y2a <= y1a <= y2b or y2b <= y1a <= y2a):
+        return True
+    if d1b == 0 and (x2a <= x1b <= x2b or x2b <= x1b <= x2a) \
+            and (y2a <= y1b <= y2b or y2b <= y1b <= y2a):
+        return True
+    if d2a == 0 and (x1a <= x2a <= x1b or x1b <= x2a <= x1a) \
+            and (y1a <= y2a <= y1b or y1b <= y2a <= y1a):
+        return True
+    if d2b == 0 and (x1a <= x2b <= x1b or x1b <= x2b <= x1a) \
+            and (y1a <= y2b <= y1b or y1b <= y2b <= y1a):
+        return True
     return False
 
 
-def intersect(e1,e2):
-    """Test whether edges e1 and e2 intersect"""       
+def intersect_by_slopes(e1,e2):
+    """
+    Test whether edges e1 and e2 intersect, by computing the intersection point of their
+    lines. This was the original version of intersect; it's kept for comparison.
+    """
     
     # First, grab all the coordinates
     ((x1a,y1a), (x1b,y1b)) = e1
@@ -132,7 +401,7 @@ def intersect(e1,e2):
 
 def collinear_point_in_edge(point, edge):
     """
-    Helper function for intersect, to test whether a point is in an edge,
+    Helper function for intersect_by_slopes, to test whether a point is in an edge,
     assuming the point and edge are already known to be collinear.
     """
     (x,y) = point
@@ -142,5 +411,58 @@ def collinear_point_in_edge(point, edge):
     if ((xa <= x <= xb) or (xb <= x <= xa)) and ((ya <= y <= yb) or (yb <= y <= ya)):
        return True
     return False
-        
 
+
+def check_intersect(trials=100000, size=20, seed=None):
+    """
+    Randomized test that intersect and intersect_by_slopes agree. Most of the pairs
+    of edges are chosen to be edge cases: axis-parallel edges (like the walls that
+    maketracks creates), collinear and overlapping edges, edges that touch at an
+    endpoint, and zero-length edges (like the ones goal_test uses). Print and return
+    a list of the pairs on which they disagree.
+    """
+    import random
+    rand = random.Random(seed)
+
+    def point():
+        return (rand.randint(0, size), rand.randint(0, size))
+
+    def edge():
+        (p, q) = (point(), point())
+        kind = rand.randint(0, 5)
+        if kind == 0:  # vertical
+            q = (p[0], q[1])
+        elif kind == 1:  # horizontal
+            q = (q[0], p[1])
+        elif kind == 2:  # zero length
+            q = p
+        return (p, q)
+
+    disagree = []
+    for i in range(trials):
+        e1 = edge()
+        kind = rand.randint(0, 3)
+        if kind == 0:  # collinear with e1, possibly overlapping it
+            ((xa, ya), (xb, yb)) = e1
+            (t1, t2) = (rand.randint(-2, 3), rand.randint(-2, 3))
+            e2 = ((xa + t1 * (xb - xa), ya + t1 * (yb - ya)), (xa + t2 * (xb - xa), ya + t2 * (yb - ya)))
+        elif kind == 1:  # shares an endpoint with e1
+            e2 = (rand.choice(e1), point())
+        elif kind == 2:  # starts at a point on e1
+            ((xa, ya), (xb, yb)) = e1
+            g = max(1, abs(xb - xa), abs(yb - ya))
+            t = rand.randint(0, g)
+            if (t * (xb - xa)) % g == 0 and (t * (yb - ya)) % g == 0:
+                e2 = ((xa + t * (xb - xa) // g, ya + t * (yb - ya) // g), point())
+            else:
+                e2 = edge()
+        else:
+            e2 = edge()
+        if rand.randint(0, 1):
+            (e1, e2) = (e2, e1)
+        if intersect(e1, e2) != intersect_by_slopes(e1, e2):
+            disagree.append((e1, e2))
+    print('check_intersect: {} trials, {} disagreements'.format(trials, len(disagree)))
+    for (e1, e2) in disagree[:10]:
+        print('   ', e1, e2, 'intersect:', intersect(e1, e2))
+    return disagree
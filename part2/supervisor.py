@@ -11,6 +11,7 @@ import random  # get random.choice
 import ast  # get ast.literal_eval
 import tdraw, turtle  # Code to use Python's "turtle drawing" package
 import proj2a  # File containing your programs for Project 2
+from racetrack import WallIndex  # grid index that lets crash skip far-away walls
 
 
 def main(problem=rect50, time_limit=5):
@@ -23,6 +24,7 @@ def main(problem=rect50, time_limit=5):
 	"""
     # print('Problem:', problem)
     (p0, f_line, walls) = problem
+    wall_index = WallIndex(walls)
 
     turtle.Screen()  # open the graphics window
     tdraw.draw_problem((p0, f_line, walls))
@@ -63,7 +65,7 @@ def main(problem=rect50, time_limit=5):
         #     (u, v), error, (xnew, ynew)))
         edge = ((x, y), (xnew, ynew))
         draw_edge(edge, 'red')
-        if crash(edge, walls):
+        if crash(edge, wall_index):
             print('\nYou have crashed.')
             count = math.inf
             break
@@ -157,7 +159,12 @@ def edist_to_line(point, edge):
 
 
 def crash(move, walls):
-    """Test whether move intersects a wall in walls"""
+    """
+    Test whether move intersects a wall in walls. If walls is a WallIndex, only the
+    walls near move are tested.
+    """
+    if isinstance(walls, WallIndex):
+        walls = walls.near(move)
     for wall in walls:
         if intersect(move, wall): return True
     return False